@@ -1,50 +1,88 @@
-from flask import Flask
+from datetime import datetime, timedelta
+
+import click
+from flask import Flask, request
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_restful import Api
 from flask_uploads import configure_uploads, patch_request_class
 
 from config import Config
-from extensions import db, jwt, image_set
-
-
-from resources.user import UserListResource, UserResource, MeResource, UserReviewListResource, UserActivateResource, UserAvatarUploadResource, UserCommentListResource
-from resources.token import TokenResource, RefreshResource, RevokeResource, black_list
-from resources.review import (ReviewListResource, ReviewResource, ReviewPublishResource,
+from extensions import db, jwt, image_set, cache, mail_queue, limiter
+from uploads import UploadRequest
+from responses import output_json, compressor
+from instrumentation import request_timer
+from metrics import request_metrics, watch_pool
+from routing import replica_router
+from unit_of_work import unit_of_work
+from profiler import profiler
+
+
+from resources.user import UserListResource, UserResource, UserSearchResource, MeResource, UserReviewListResource, UserActivateResource, UserAvatarUploadResource, UserAvatarJobResource, UserCommentListResource
+from resources.token import TokenResource, RefreshResource, RevokeResource
+from resources.review import (ReviewListResource, ReviewResource, ReviewPublishResource, ReviewSearchResource,
                               ReviewCommentListResource, ReviewCommentResource, ReviewCommentPublishResource)
 
+from models.avatar_job import AvatarJob
+from models.comment import Comment
+from models.review import Review
+from models.revoked_token import RevokedToken
+from seed import seed
+from revocation import revoked_tokens
+from avatar_jobs import avatar_processor
+
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.request_class = UploadRequest  # checks uploaded images while they are read
 
     register_extensions(app)
     register_resources(app)
+    register_commands(app)
+    register_hooks(app)
 
     return app
 
 
 def register_extensions(app):
+    replica_router.init_app(app)
     db.init_app(app)
     migrate = Migrate(app, db)
     jwt.init_app(app)
     configure_uploads(app, image_set)
-    patch_request_class(app, 10 * 1024 * 1024)
+    patch_request_class(app, app.config['AVATAR_MAX_SIZE'])
+    cache.init_app(app)
+    # data cached from a replica can predate the user's own write, or anyone's recent one
+    cache.bypass = replica_router.sticky
+    cache.on_fresh_read = replica_router.read_primary
+    revoked_tokens.init_app(app)
+    mail_queue.init_app(app)
+    avatar_processor.init_app(app)
+    limiter.init_app(app)
+    compressor.init_app(app)
+    request_timer.init_app(app)
+    request_metrics.init_app(app)
+    profiler.init_app(app)
+    unit_of_work.init_app(app)     # registered last, so its commit runs before the other after_request hooks
 
     @jwt.token_in_blacklist_loader
     def check_if_token_in_blacklist(decrypted_token):
         jti = decrypted_token['jti']
-        return jti in black_list
+        return revoked_tokens.is_revoked(jti)
 
 
 def register_resources(app):
 
     api = Api(app)
+    api.representation('application/json')(output_json)
 
     api.add_resource(UserListResource, '/users')
     api.add_resource(UserActivateResource, '/users/activate/<string:token>')
+    api.add_resource(UserSearchResource, '/users/search')
     api.add_resource(UserResource, '/users/<string:username>')
     api.add_resource(UserAvatarUploadResource, '/users/avatar')
+    api.add_resource(UserAvatarJobResource, '/users/avatar/jobs/<string:job_id>')
     api.add_resource(UserReviewListResource, '/users/<string:username>/reviews')
     api.add_resource(UserCommentListResource, '/users/<string:username>/comments')
 
@@ -55,6 +93,7 @@ def register_resources(app):
     api.add_resource(RevokeResource, '/revoke')
 
     api.add_resource(ReviewListResource, '/reviews')
+    api.add_resource(ReviewSearchResource, '/reviews/search')
     api.add_resource(ReviewResource, '/reviews/<int:review_id>')
     api.add_resource(ReviewPublishResource, '/reviews/<int:review_id>/publish')
 
@@ -63,6 +102,70 @@ def register_resources(app):
     api.add_resource(ReviewCommentPublishResource, '/reviews/<int:review_id>/comments/<int:comment_id>/publish')
 
 
+def register_hooks(app):
+
+    @app.before_request
+    def time_pool_checkouts():
+        # the engine is created on first use, and again after a dispose
+        watch_pool(db.engine.pool)
+
+    @app.after_request
+    def cache_avatar_images(response):
+        # content addressed avatars (images/avatars/ab/cd/<hash>_<size>.<ext>) never change
+        if request.endpoint == 'static' and request.view_args['filename'].count('/') == 4 \
+                and request.view_args['filename'].startswith('images/avatars/'):
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+
+        return response
+
+
+def register_commands(app):
+
+    @app.cli.command('recount-comments')
+    def recount_comments():
+        updated = Comment.recount_review_comments()
+        click.echo('Recounted comments of {} reviews.'.format(updated))
+
+    @app.cli.command('reindex-reviews')
+    def reindex_reviews():
+        # fills the search vector of reviews saved before full text search existed (postgres)
+        Review.reindex()
+        click.echo('Reindexed reviews.')
+
+    @app.cli.command('purge-deleted-reviews')
+    def purge_deleted_reviews():
+        # finishes deferred deletes that were interrupted, e.g. by a restart
+        review_ids = Review.get_all_deleted_ids()
+
+        for review_id in review_ids:
+            Review.purge(review_id, batch_size=app.config['REVIEW_PURGE_BATCH_SIZE'])
+
+        click.echo('Purged {} deleted reviews.'.format(len(review_ids)))
+
+    @app.cli.command('purge-revoked-tokens')
+    def purge_revoked_tokens():
+        # expired tokens are rejected anyway, this only keeps the table small, e.g. from a daily cron job
+        deleted = RevokedToken.delete_expired()
+        click.echo('Deleted {} expired revoked tokens.'.format(deleted))
+
+    @app.cli.command('purge-avatar-jobs')
+    @click.option('--hours', default=24, show_default=True)
+    def purge_avatar_jobs(hours):
+        # clients poll a job right after the upload, older ones are not asked for anymore
+        deleted = AvatarJob.delete_created_before(datetime.utcnow() - timedelta(hours=hours))
+        click.echo('Deleted {} avatar jobs.'.format(deleted))
+
+    @app.cli.command('seed')
+    @click.option('--users', default=100, show_default=True)
+    @click.option('--reviews', default=1000, show_default=True)
+    @click.option('--comments', default=10000, show_default=True)
+    @click.option('--batch-size', default=1000, show_default=True)
+    @click.option('--random-seed', default=0, show_default=True, help='Same seed, same data.')
+    def seed_database(users, reviews, comments, batch_size, random_seed):
+        counts = seed(users=users, reviews=reviews, comments=comments, batch_size=batch_size, random_seed=random_seed)
+        click.echo('Inserted {} users, {} reviews and {} comments.'.format(*counts))
+
+
 if __name__ == '__main__':
     app = create_app()
     CORS(app)
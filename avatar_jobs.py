@@ -0,0 +1,185 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from extensions import db, cache
+from metrics import image_duration
+from models.avatar_job import AvatarJob
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+from search import username_prefixes
+from unit_of_work import unit_of_work
+from utils import make_avatar_variants, remove_avatar
+
+logger = logging.getLogger(__name__)
+
+
+def timed_avatar_variants(source_path, destination):
+    # runs in the pool, returns the processing time without the time spent queued
+    start = time.perf_counter()
+    variants = make_avatar_variants(source_path, destination)
+    return variants, time.perf_counter() - start
+
+
+class AvatarProcessor:
+    """Turns uploaded avatars into size variants in a bounded process pool.
+
+    Job status is kept in the avatar_job table, so any worker can answer a
+    poll. At most IMAGE_MAX_PENDING avatars of this process are queued or
+    being resized at a time, further uploads are turned away. A pool broken
+    by a dying child process is replaced on the next upload. Finished images
+    are saved to the user by one result thread with its own app context, the
+    pool's callback thread only hands them over.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.executor = None
+        self.max_workers = None
+        self.max_pending = 32
+        self.pending = 0
+        self.results = queue.Queue()
+        self.result_worker = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.max_workers = app.config.get('IMAGE_WORKERS') or os.cpu_count()
+        self.max_pending = app.config.get('IMAGE_MAX_PENDING', 32)
+
+    def submit(self, user_id, source_path, destination):
+        """Queue an avatar for processing, returns the job id or None when the pool is full."""
+
+        # the slot is taken right away, concurrent uploads can not all get past the check
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return None
+            self.pending += 1
+
+        try:
+            job = AvatarJob(id=uuid.uuid4().hex, user_id=user_id)
+            job.save()
+        except Exception:
+            self.release(source_path)
+            raise
+
+        # queued once the job row is committed, the result thread reads it
+        unit_of_work.after_commit(partial(self.start, job.id, source_path, destination))
+        unit_of_work.after_rollback(partial(self.release, source_path))
+
+        return job.id
+
+    def start(self, job_id, source_path, destination):
+        submitted_at = time.monotonic()
+
+        try:
+            future = self.run(timed_avatar_variants, source_path, destination)
+        except Exception:
+            logger.exception('Queueing avatar failed')
+            self.release(source_path)
+            AvatarJob.fail(job_id)
+            image_duration.observe(time.monotonic() - submitted_at, stage='total', outcome='failed')
+            return
+
+        self.start_result_worker()
+        future.add_done_callback(partial(self.hand_over, job_id, source_path, submitted_at))
+
+    def run(self, func, *args):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+            try:
+                return self.executor.submit(func, *args)
+            except BrokenProcessPool:
+                # a child process died, the pool takes no more work
+                logger.warning('Image process pool is broken, starting a new one')
+                self.executor.shutdown(wait=False)
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                return self.executor.submit(func, *args)
+
+    def start_result_worker(self):
+        with self.lock:
+            if self.result_worker is None or not self.result_worker.is_alive():
+                self.result_worker = threading.Thread(target=self.work, daemon=True)
+                self.result_worker.start()
+
+    def hand_over(self, job_id, source_path, submitted_at, future):
+        # runs in the pool's callback thread, which has no app context
+        self.results.put((job_id, source_path, submitted_at, future))
+
+    def work(self):
+        while True:
+            job_id, source_path, submitted_at, future = self.results.get()
+
+            try:
+                with self.app.app_context():
+                    self.finish(job_id, source_path, submitted_at, future)
+            except Exception:
+                logger.exception('Finishing avatar job %s failed', job_id)
+            finally:
+                self.results.task_done()
+
+    def finish(self, job_id, source_path, submitted_at, future):
+        outcome = 'failed'
+
+        try:
+            variants, seconds = future.result()
+            self.set_avatar(job_id, variants)
+
+            outcome = 'done'
+            image_duration.observe(seconds, stage='process', outcome='done')
+        except Exception:
+            logger.exception('Processing avatar failed')
+        finally:
+            # also when saving the avatar went wrong, a job never stays pending
+            self.release(source_path)
+            if outcome == 'failed':
+                self.fail(job_id)
+
+            image_duration.observe(time.monotonic() - submitted_at, stage='total', outcome=outcome)
+
+    def release(self, source_path):
+        if os.path.exists(source_path):
+            os.remove(source_path)
+
+        with self.lock:
+            self.pending -= 1
+
+    def set_avatar(self, job_id, variants):
+        job = AvatarJob.get_by_id(job_id)
+        user = User.get_by_id(id=job.user_id)
+
+        previous = user.avatar_image
+
+        user.avatar_image = variants[str(max(map(int, variants)))]['jpg']
+        job.variants = variants
+        job.status = 'done'
+        job.save()      # user and job in one commit
+
+        # identical images are stored once, keep them while another user still has them
+        if previous and previous != user.avatar_image and not User.avatar_in_use(previous):
+            remove_avatar(previous, folder='avatars')
+
+        # the avatar url is nested as author in the user's reviews and comments and in review lists
+        cache.invalidate('user:{}'.format(user.username), 'reviews',
+                         *['review:{}'.format(review_id) for review_id in Review.get_ids_by_user(user.id)],
+                         *['comments:{}'.format(review_id) for review_id in Comment.get_commented_review_ids(user.id)])
+        username_prefixes.invalidate(user.username)
+
+    def fail(self, job_id):
+        try:
+            db.session.rollback()
+            AvatarJob.fail(job_id)
+        except Exception:
+            logger.exception('Marking avatar job %s failed did not work', job_id)
+
+
+avatar_processor = AvatarProcessor()
@@ -0,0 +1,64 @@
+"""Throughput of the avatar pipeline (render_avatar_variants), per core and for the whole pool.
+
+    python benchmarks/avatar_throughput.py --images 40 --width 4000 --height 3000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from utils import render_avatar_variants
+
+
+def make_source(directory, width, height):
+    path = os.path.join(directory, 'source.jpg')
+    Image.effect_noise((width, height), 64).convert('RGB').save(path, quality=90)
+    return path
+
+
+def run(source, destination, index):
+    return render_avatar_variants(source, destination, 'bench-{}'.format(index))
+
+
+def measure(source, destination, images, workers):
+    start = time.perf_counter()
+
+    if workers == 1:
+        for i in range(images):
+            run(source, destination, i)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run, [source] * images, [destination] * images, range(images)))
+
+    return images / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--width', type=int, default=4000)
+    parser.add_argument('--height', type=int, default=3000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        source = make_source(directory, args.width, args.height)
+        destination = os.path.join(directory, 'avatars')
+
+        single = measure(source, destination, args.images, 1)
+        pooled = measure(source, destination, args.images, args.workers)
+
+        print('source {}x{}, {} images'.format(args.width, args.height, args.images))
+        print('1 worker:   {:.2f} images/s'.format(single))
+        print('{} workers: {:.2f} images/s ({:.2f} per core)'.format(args.workers, pooled, pooled / args.workers))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,72 @@
+"""Local stand-in for the mailgun messages API.
+
+Run it and point the app at it to exercise the mail queue without sending
+real emails:
+
+    python benchmarks/fake_mailgun.py --port 5001 --failure-rate 0.2
+    MAILGUN_API_URL=http://localhost:5001/v3/{}/messages python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+stats = {'requests': 0, 'failed': 0, 'recipients': 0}
+stats_lock = threading.Lock()
+
+
+class MailgunHandler(BaseHTTPRequestHandler):
+    failure_rate = 0.0
+    latency = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        recipients = parse_qs(body).get('to', [])
+
+        time.sleep(self.latency)
+        failed = random.random() < self.failure_rate
+
+        with stats_lock:
+            stats['requests'] += 1
+            if failed:
+                stats['failed'] += 1
+            else:
+                stats['recipients'] += len(recipients)
+
+        status = 503 if failed else 200
+        payload = json.dumps({'id': '<fake@mailgun>', 'message': 'Queued. Thank you.'}).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        payload = json.dumps(stats).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    args = parser.parse_args()
+
+    MailgunHandler.failure_rate = args.failure_rate
+    MailgunHandler.latency = args.latency
+
+    print('Fake mailgun listening on port {}, GET / for delivery stats'.format(args.port))
+    ThreadingHTTPServer(('', args.port), MailgunHandler).serve_forever()
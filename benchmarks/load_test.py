@@ -0,0 +1,444 @@
+"""Throughput and latency of every API route under a real WSGI server.
+
+Runs create_app() in a threaded werkzeug server in a child process (or
+targets a running server with --url, e.g. gunicorn -w 4 'app:create_app()'),
+drives each route registered in register_resources for a fixed time and
+saves requests per second and p50/p95/p99 latency per route as JSON. Run it
+from the repository root against a database filled by flask seed:
+
+    export DATABASE_URL=sqlite:////tmp/review-blog.db    # or a local postgres url
+    flask db upgrade
+    flask seed --users 1000 --reviews 20000 --comments 200000
+    python benchmarks/load_test.py --duration 10 --output results-$(git rev-parse --short HEAD).json
+    python benchmarks/load_test.py --compare results-1f9b1fc.json results-2ba3d10.json
+
+Routes that need fresh data for every request (deletes, activation, revoke)
+create it in an untimed prepare step. The step still takes wall time, so
+compare their throughput between runs rather than with other routes.
+"""
+import argparse
+import gzip
+import http.client
+import itertools
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import urlsplit, urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def serve(port, rate_limits):
+    from werkzeug.serving import make_server
+
+    from config import Config
+
+    Config.DEBUG = False
+    if not rate_limits:
+        Config.RATE_LIMITS = {}     # measure the endpoints, not the token buckets
+
+    from app import create_app
+
+    make_server('127.0.0.1', port, create_app(), threaded=True).serve_forever()
+
+
+def start_server(port, rate_limits):
+    process = multiprocessing.get_context('spawn').Process(target=serve, args=(port, rate_limits), daemon=True)
+    process.start()
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    raise SystemExit('Server did not start on port {}'.format(port))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    """One keep-alive connection per thread."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.local = threading.local()
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return self.local.connection
+
+    def request(self, method, path, body=None, token=None, files=None):
+        """Returns (status, decoded json or None, seconds)."""
+
+        headers = {'Accept-Encoding': 'gzip'}
+        data = None
+
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+
+        if files:
+            data, headers['Content-Type'] = multipart(files)
+        elif body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        connection = self.connection()
+        start = time.perf_counter()
+
+        try:
+            connection.request(method, path, body=data, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            return None, None, time.perf_counter() - start
+
+        seconds = time.perf_counter() - start
+
+        try:
+            if response.getheader('Content-Encoding') == 'gzip':
+                payload = gzip.decompress(payload)
+            return response.status, json.loads(payload) if payload else None, seconds
+        except ValueError:
+            return response.status, None, seconds
+
+
+def multipart(files):
+    boundary = uuid.uuid4().hex
+    body = BytesIO()
+
+    for name, (filename, content, content_type) in files.items():
+        body.write('--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+                   'Content-Type: {}\r\n\r\n'.format(boundary, name, filename, content_type).encode())
+        body.write(content)
+        body.write(b'\r\n')
+
+    body.write('--{}--\r\n'.format(boundary).encode())
+
+    return body.getvalue(), 'multipart/form-data; boundary=' + boundary
+
+
+def avatar_image():
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new('RGB', (1200, 900), (120, 80, 200)).save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+class Context:
+    """Ids and tokens the routes need, looked up or created once before the run."""
+
+    def __init__(self, client, email, password, secret_key):
+        self.client = client
+        self.email = email
+        self.password = password
+        self.secret_key = secret_key
+        self.run = uuid.uuid4().hex[:8]
+        self.counter = itertools.count()
+        self.image = avatar_image()
+
+        status, tokens, _ = client.request('POST', '/token', {'email': email, 'password': password})
+        if status != 200:
+            raise SystemExit('Could not log in as {}, seed the database first ({})'.format(email, status))
+
+        self.access_token = tokens['access_token']
+        self.refresh_token = tokens['refresh_token']
+
+        status, me, _ = client.request('GET', '/me', token=self.access_token)
+        self.username = me['username']
+
+        status, page, _ = client.request('GET', '/reviews?limit=100')
+        reviews = page['data'] if status == 200 else []
+        if not reviews:
+            raise SystemExit('There are no published reviews, seed the database first')
+
+        # a review with comments, so the comment routes return data
+        review = max(reviews, key=lambda item: item['comments'] or 0)
+        self.review_id = review['id']
+
+        status, comments, _ = client.request('GET', '/reviews/{}/comments?limit=1'.format(self.review_id))
+        self.comment_id = comments['data'][0]['id'] if status == 200 else 0
+
+        self.own_review_id = self.create_review()
+        self.own_comment_id = self.create_comment()
+
+        status, job, _ = client.request('PUT', '/users/avatar', token=self.access_token,
+                                        files={'avatar': ('avatar.jpg', self.image, 'image/jpeg')})
+        self.job_id = job['job_id'] if status == 202 else 'missing'
+
+    def unique(self):
+        return '{}{}'.format(self.run, next(self.counter))
+
+    def create_review(self):
+        status, review, _ = self.client.request('POST', '/reviews', self.review_body(), token=self.access_token)
+        self.client.request('PUT', '/reviews/{}/publish'.format(review['id']), token=self.access_token)
+        return review['id']
+
+    def create_comment(self):
+        status, comment, _ = self.client.request('POST', '/reviews/{}/comments'.format(self.own_review_id),
+                                                 self.comment_body(), token=self.access_token)
+        return comment['id']
+
+    def review_body(self):
+        return {'title': 'Benchmark review', 'content': 'Written by the load test. ' * 10, 'rating': 7}
+
+    def comment_body(self):
+        return {'content': 'Written by the load test.', 'review_helpful': True}
+
+    def registration_body(self):
+        name = 'bench' + self.unique()
+        return {'username': name, 'email': name + '@example.com', 'password': self.password}
+
+    def register(self):
+        body = self.registration_body()
+        self.client.request('POST', '/users', body)
+        return body['email']
+
+    def activation_token(self, email):
+        from itsdangerous import URLSafeTimedSerializer
+        return URLSafeTimedSerializer(self.secret_key).dumps(email, salt='activate')
+
+    def fresh_access_token(self):
+        status, data, _ = self.client.request('POST', '/refresh', token=self.refresh_token)
+        return data['token']
+
+
+class Route:
+
+    def __init__(self, name, method, path, body=None, token=None, files=None, prepare=None):
+        self.name = name        # method and url rule, the same in every run
+        self.method = method
+        self.path = path        # callables take the context
+        self.body = body
+        self.token = token
+        self.files = files
+        self.prepare = prepare  # untimed, returns a value the callables get as second argument
+
+    def request(self, context):
+        prepared = self.prepare(context) if self.prepare else None
+
+        def value(item):
+            return item(context, prepared) if callable(item) else item
+
+        return dict(method=self.method, path=value(self.path), body=value(self.body),
+                    token=value(self.token), files=value(self.files))
+
+
+def access(context, prepared=None):
+    return context.access_token
+
+
+def routes():
+    review = '/reviews/{}'
+    comment = '/reviews/{}/comments/{}'
+
+    return [
+        Route('POST /users', 'POST', '/users', body=lambda c, p: c.registration_body()),
+        Route('GET /users/activate/<token>', 'GET', lambda c, email: '/users/activate/' + c.activation_token(email),
+              prepare=lambda c: c.register()),
+        Route('GET /users/search', 'GET', '/users/search?prefix=user'),
+        Route('GET /users/<username>', 'GET', lambda c, p: '/users/' + c.username),
+        Route('GET /users/<username> authorized', 'GET', lambda c, p: '/users/' + c.username, token=access),
+        Route('PUT /users/avatar', 'PUT', '/users/avatar', token=access,
+              files=lambda c, p: {'avatar': ('avatar.jpg', c.image, 'image/jpeg')}),
+        Route('GET /users/avatar/jobs/<job_id>', 'GET', lambda c, p: '/users/avatar/jobs/' + c.job_id, token=access),
+        Route('GET /users/<username>/reviews', 'GET', lambda c, p: '/users/{}/reviews'.format(c.username)),
+        Route('GET /users/<username>/comments', 'GET', lambda c, p: '/users/{}/comments'.format(c.username)),
+        Route('GET /me', 'GET', '/me', token=access),
+
+        Route('POST /token', 'POST', '/token',
+              body=lambda c, p: {'email': c.email, 'password': c.password}),
+        Route('POST /refresh', 'POST', '/refresh', token=lambda c, p: c.refresh_token),
+        Route('POST /revoke', 'POST', '/revoke', token=lambda c, token: token,
+              prepare=lambda c: c.fresh_access_token()),
+
+        Route('GET /reviews', 'GET', '/reviews'),
+        Route('GET /reviews?sort=rating', 'GET', '/reviews?sort=rating'),
+        Route('POST /reviews', 'POST', '/reviews', body=lambda c, p: c.review_body(), token=access),
+        Route('GET /reviews/search', 'GET', '/reviews/search?' + urlencode({'q': 'coffee'})),
+        Route('GET /reviews/<review_id>', 'GET', lambda c, p: review.format(c.review_id)),
+        Route('PATCH /reviews/<review_id>', 'PATCH', lambda c, p: review.format(c.own_review_id),
+              body={'rating': 8}, token=access),
+        Route('DELETE /reviews/<review_id>', 'DELETE', lambda c, review_id: review.format(review_id), token=access,
+              prepare=lambda c: c.create_review()),
+        Route('PUT /reviews/<review_id>/publish', 'PUT', lambda c, p: (review + '/publish').format(c.own_review_id),
+              token=access),
+        Route('DELETE /reviews/<review_id>/publish', 'DELETE',
+              lambda c, p: (review + '/publish').format(c.own_review_id), token=access),
+
+        Route('GET /reviews/<review_id>/comments', 'GET', lambda c, p: (review + '/comments').format(c.review_id)),
+        Route('POST /reviews/<review_id>/comments', 'POST', lambda c, p: (review + '/comments').format(c.own_review_id),
+              body=lambda c, p: c.comment_body(), token=access),
+        Route('GET /reviews/<review_id>/comments/<comment_id>', 'GET',
+              lambda c, p: comment.format(c.review_id, c.comment_id)),
+        Route('PATCH /reviews/<review_id>/comments/<comment_id>', 'PATCH',
+              lambda c, p: comment.format(c.own_review_id, c.own_comment_id),
+              body={'content': 'Edited by the load test.'}, token=access),
+        Route('DELETE /reviews/<review_id>/comments/<comment_id>', 'DELETE',
+              lambda c, comment_id: comment.format(c.own_review_id, comment_id), token=access,
+              prepare=lambda c: c.create_comment()),
+        Route('PUT /reviews/<review_id>/comments/<comment_id>/publish', 'PUT',
+              lambda c, p: (comment + '/publish').format(c.own_review_id, c.own_comment_id), token=access),
+        Route('DELETE /reviews/<review_id>/comments/<comment_id>/publish', 'DELETE',
+              lambda c, p: (comment + '/publish').format(c.own_review_id, c.own_comment_id), token=access),
+    ]
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1)]
+
+
+def run_route(client, context, route, duration, concurrency):
+    latencies = []
+    statuses = Counter()
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def work():
+        nonlocal errors
+
+        while time.monotonic() < deadline:
+            status, _, seconds = client.request(**route.request(context))
+            with lock:
+                latencies.append(seconds)
+                statuses[str(status)] += 1
+                errors += status is None or status >= 500
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    start = time.monotonic()
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+    latencies.sort()
+
+    def milliseconds(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {'requests': len(latencies),
+            'errors': errors,
+            'status_codes': dict(statuses),
+            'prepared': route.prepare is not None,
+            'throughput': round(len(latencies) / elapsed, 2),
+            'p50_ms': milliseconds(percentile(latencies, 0.50)),
+            'p95_ms': milliseconds(percentile(latencies, 0.95)),
+            'p99_ms': milliseconds(percentile(latencies, 0.99)),
+            'max_ms': milliseconds(latencies[-1] if latencies else None)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print('{:<62} {:>9} {:>9} {:>9} {:>9} {:>7}'.format('route', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for name, result in results['routes'].items():
+        print('{:<62} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(name, result['throughput'], result['p50_ms'],
+                                                            result['p95_ms'], result['p99_ms'], result['errors']))
+
+
+def compare(old_path, new_path):
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    def change(before, after):
+        if not before or after is None:
+            return 'n/a'
+        return '{:+.1f}%'.format((after - before) / before * 100)
+
+    print('{} -> {}'.format(old.get('commit'), new.get('commit')))
+    print('{:<62} {:>10} {:>10} {:>10}'.format('route', 'req/s', 'p50', 'p99'))
+    for name, result in new['routes'].items():
+        before = old['routes'].get(name)
+        if before is None:
+            continue
+        print('{:<62} {:>10} {:>10} {:>10}'.format(name, change(before['throughput'], result['throughput']),
+                                                   change(before['p50_ms'], result['p50_ms']),
+                                                   change(before['p99_ms'], result['p99_ms'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='benchmark a running server instead of starting one')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--email', default='user1@example.com', help='seeded user to log in as')
+    parser.add_argument('--routes', nargs='*', help='only routes whose name contains one of these')
+    parser.add_argument('--rate-limits', action='store_true', help='keep RATE_LIMITS of the started server')
+    parser.add_argument('--output', help='json file for the results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        raise SystemExit()
+
+    from config import Config
+    from seed import SEED_PASSWORD
+
+    server = None
+    url = args.url
+
+    if url is None:
+        port = free_port()
+        server = start_server(port, args.rate_limits)
+        url = 'http://127.0.0.1:{}'.format(port)
+
+    try:
+        client = Client(url)
+        context = Context(client, args.email, SEED_PASSWORD, Config.SECRET_KEY)
+
+        selected = [route for route in routes()
+                    if not args.routes or any(part in route.name for part in args.routes)]
+
+        results = {'commit': git_commit(),
+                   'started_at': datetime.utcnow().isoformat(),
+                   'url': url,
+                   'database': urlsplit(os.environ.get('DATABASE_URL', Config.SQLALCHEMY_DATABASE_URI)).scheme,
+                   'duration': args.duration,
+                   'concurrency': args.concurrency,
+                   'routes': {}}
+
+        for route in selected:
+            results['routes'][route.name] = run_route(client, context, route, args.duration, args.concurrency)
+    finally:
+        if server is not None:
+            server.terminate()
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
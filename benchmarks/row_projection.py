@@ -0,0 +1,86 @@
+"""Time and memory of loading published reviews as ORM instances against slotted rows.
+
+Fills a temporary sqlite database with flask seed's generator, then loads
+every published review with get_all_published() and get_all_published_rows()
+and dumps both with the compiled list schema. Numbers are per 10k rows.
+
+    python benchmarks/row_projection.py --reviews 20000
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(load, dump, repeat):
+    best_load = best_dump = float('inf')
+
+    for _ in range(repeat):
+        db.session.remove()     # empty identity map, nothing carried over between runs
+        gc.collect()
+
+        start = time.perf_counter()
+        items = load()
+        best_load = min(best_load, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        dump(items)
+        best_dump = min(best_dump, time.perf_counter() - start)
+
+        del items
+
+    # memory in a separate run, tracing slows allocations down
+    db.session.remove()
+    gc.collect()
+
+    tracemalloc.start()
+    items = load()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = len(items)
+
+    scale = 10000 / count
+    return {'rows': count,
+            'load_ms': best_load * 1000 * scale,
+            'dump_ms': best_dump * 1000 * scale,
+            'retained_mb': retained / 2 ** 20 * scale,
+            'peak_mb': peak / 2 ** 20 * scale}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--reviews', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'rows.db')
+
+    from app import create_app
+    from extensions import db
+    from models.review import Review
+    from resources.review import review_list_schema
+    from seed import seed
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        seed(users=200, reviews=args.reviews, comments=0, batch_size=5000, publish_ratio=1.0)
+
+        with app.test_request_context():
+            results = {'get_all_published()': measure(Review.get_all_published, review_list_schema.dump, args.repeat),
+                       'get_all_published_rows()': measure(Review.get_all_published_rows, review_list_schema.dump,
+                                                           args.repeat)}
+
+    print('{} published reviews, per 10k rows:'.format(results['get_all_published()']['rows']))
+    print('{:<28} {:>10} {:>10} {:>13} {:>10}'.format('', 'load ms', 'dump ms', 'retained MB', 'peak MB'))
+    for name, result in results.items():
+        print('{:<28} {:>10.1f} {:>10.1f} {:>13.2f} {:>10.2f}'.format(name, result['load_ms'], result['dump_ms'],
+                                                                       result['retained_mb'], result['peak_mb']))
@@ -0,0 +1,72 @@
+"""Rows per second of the marshmallow list schemas against their compiled versions.
+
+Also checks that both produce the same data before timing them.
+
+    python benchmarks/serializer_throughput.py --rows 10000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from schemas.comment import CommentSchema
+from schemas.compiled import CompiledSchema
+from schemas.review import ReviewSchema
+
+
+def make_rows(count):
+    authors = [SimpleNamespace(id=i, username='user{}'.format(i), email='user{}@example.com'.format(i),
+                               avatar_image=None if i % 2 else 'ab/cd/{:064x}_1024.jpg'.format(i),
+                               created_at=datetime(2021, 1, 1), updated_at=datetime(2021, 1, 2))
+               for i in range(100)]
+
+    now = datetime(2021, 6, 1, 12, 30, 15, 123456)
+
+    reviews = [SimpleNamespace(id=i, title='Review {}'.format(i), content='Content ' * 20, rating=i % 10 + 1,
+                               comments=i % 7, is_publish=True, user=authors[i % 100],
+                               created_at=now - timedelta(minutes=i), updated_at=now)
+               for i in range(count)]
+
+    comments = [SimpleNamespace(id=i, review_id=i % 50, content='Comment ' * 10, review_helpful=bool(i % 2),
+                                is_publish=True, user=authors[i % 100],
+                                created_at=now - timedelta(minutes=i), updated_at=now)
+                for i in range(count)]
+
+    return reviews, comments
+
+
+def rows_per_second(dump, rows, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        dump(rows)
+    return len(rows) * repeat / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__, static_folder=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static'))
+    reviews, comments = make_rows(args.rows)
+
+    with app.test_request_context():
+        for name, schema, rows in (('reviews', ReviewSchema(many=True), reviews),
+                                   ('comments', CommentSchema(many=True), comments)):
+            compiled = CompiledSchema(schema)
+
+            if schema.dump(rows).data != compiled.dump(rows):
+                sys.exit('{}: compiled output differs from marshmallow'.format(name))
+
+            slow = rows_per_second(lambda r: schema.dump(r).data, rows, args.repeat)
+            fast = rows_per_second(compiled.dump, rows, args.repeat)
+
+            print('{:<9} marshmallow {:>10.0f} rows/s   compiled {:>10.0f} rows/s   {:.1f}x'.format(
+                name, slow, fast, fast / slow))
@@ -0,0 +1,218 @@
+import itertools
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context
+
+
+class LRUCache:
+    """In-process LRU cache with a per-entry time to live.
+
+    Also serves as the local stand-in for RedisCache, both expose the same
+    get/set/generation/bump/clear interface. Generations are entries as well,
+    so they are bounded and evicted like everything else.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl or self.ttl)
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def generation(self, namespace):
+        generation = self.get('gen:' + namespace)
+        if generation is None:
+            generation = self.bump(namespace)
+        return generation
+
+    def bump(self, namespace):
+        # every generation comes from one counter, a namespace whose generation was
+        # evicted or cleared never gets an old one back, so its old keys stay unreachable
+        generation = next(self.counter)
+        self.set('gen:' + namespace, generation)
+        return generation
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisCache:
+    """Cache shared by every worker, needs the optional redis package."""
+
+    def __init__(self, url, ttl=60, prefix='review-blog:cache:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or self.ttl)
+
+    def generation(self, namespace):
+        return int(self.client.get(self.prefix + 'gen:' + namespace) or 0)
+
+    def bump(self, namespace):
+        self.client.incr(self.prefix + 'gen:' + namespace)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class _Flight:
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.done = False
+        self.value = None
+
+
+class ResponseCache:
+    """Caches serialized resource data.
+
+    Keys live in namespaces (e.g. 'reviews' or 'review:5'). Every key embeds the
+    generation of its namespace, so invalidate() drops all keys of a namespace
+    at once by bumping the generation.
+
+    Without CACHE_REDIS_URL the cache lives in each worker process and an
+    invalidation only reaches the worker that handled the write, the others
+    serve their entries until CACHE_TTL. Run more than one worker only with
+    redis.
+
+    For fresh_seconds after an invalidation the keys of the namespace call
+    on_fresh_read, so the request loads what it caches from the primary
+    instead of from a replica that may not have the change yet.
+    """
+
+    def __init__(self):
+        self.backend = LRUCache()
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.bypass = lambda: False     # requests it returns True for always load fresh data
+        self.fresh_seconds = 0
+        self.on_fresh_read = lambda: None
+
+    def init_app(self, app):
+        ttl = app.config.get('CACHE_TTL', 60)
+
+        # only replicas lag behind the writes
+        if app.config.get('SQLALCHEMY_REPLICA_URIS'):
+            self.fresh_seconds = app.config.get('CACHE_FRESH_SECONDS', app.config.get('REPLICA_STICKY_SECONDS', 5))
+        else:
+            self.fresh_seconds = 0
+
+        if app.config.get('CACHE_REDIS_URL'):
+            self.backend = RedisCache(app.config['CACHE_REDIS_URL'], ttl=ttl)
+        else:
+            self.backend = LRUCache(maxsize=app.config.get('CACHE_MAX_SIZE', 1024), ttl=ttl)
+
+    def key(self, namespace, *parts):
+        self.read_fresh(namespace)
+
+        generation = self.backend.generation(namespace)
+        return ':'.join([namespace, str(generation)] + [str(part) for part in parts])
+
+    def get_or_set(self, key, loader, ttl=None):
+        if self.bypass():
+            return loader()
+
+        value = self.backend.get(key)
+        if value is not None:
+            return value
+
+        # single flight: only one thread per process runs the loader for a missing key
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.done:
+                return flight.value
+            return loader()
+
+        try:
+            value = loader()
+            if value is not None:
+                self.backend.set(key, value, ttl)
+            flight.value = value
+            flight.done = True
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+        return value
+
+    def invalidate(self, *namespaces):
+        for namespace in namespaces:
+            self.backend.bump(namespace)
+            self.mark_fresh(namespace)
+
+        if has_request_context():
+            g.setdefault('invalidated', set()).update(namespaces)
+
+    def invalidate_committed(self):
+        # bumped again once the request's transaction is committed (unit_of_work.py), so
+        # entries loaded from the old rows between invalidate() and the commit are dropped too
+        for namespace in g.pop('invalidated', ()):
+            self.backend.bump(namespace)
+            self.mark_fresh(namespace)
+
+    def mark_fresh(self, namespace):
+        if self.fresh_seconds:
+            self.backend.set('fresh:' + namespace, True, ttl=self.fresh_seconds)
+
+    def read_fresh(self, namespace):
+        """Calls on_fresh_read when the namespace was invalidated in the last fresh_seconds.
+
+        key() does this for cached data, uncached reads of a namespace call it themselves.
+        """
+
+        if self.fresh_seconds and self.backend.get('fresh:' + namespace) is not None:
+            self.on_fresh_read()
+
+    def clear(self):
+        self.backend.clear()
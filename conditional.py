@@ -0,0 +1,75 @@
+import hashlib
+from datetime import timezone
+from http import HTTPStatus
+
+from flask import request
+from werkzeug.http import http_date
+
+from extensions import db
+from models.user import User
+
+
+def make_etag(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def last_change(*timestamps):
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(timestamps) if timestamps else None
+
+
+def list_validator(query):
+    """Row count and latest change of the rows of a list query and of their authors.
+
+    Any insert, update, delete or publish state change of a row, or a change of
+    an author, moves one of these values. Both go into the list's ETag only,
+    the latest change alone stays put when a row leaves the list, so lists
+    send no Last-Modified and If-Modified-Since never matches them.
+    """
+
+    count, rows_changed, authors_changed = list_validator_query(query).one()
+
+    return count, last_change(rows_changed, authors_changed)
+
+
+def list_validator_query(query):
+    rows = query.subquery()     # subquery() leaves out the joined authors of the list query
+
+    return db.session.query(db.func.count(rows.c.id), db.func.max(rows.c.updated_at), db.func.max(User.updated_at)) \
+        .select_from(rows) \
+        .outerjoin(User, User.id == rows.c.user_id)
+
+
+def validator_headers(etag, last_modified=None, vary=None):
+    headers = {'ETag': 'W/"{}"'.format(etag)}
+
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.replace(tzinfo=timezone.utc))
+
+    if vary is not None:
+        headers['Vary'] = vary
+
+    return headers
+
+
+def not_modified(etag, last_modified=None, vary=None):
+    """304 response when the client's copy is current, otherwise None."""
+
+    headers = validator_headers(etag, last_modified, vary=vary)
+
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if request.if_none_match:
+        if request.if_none_match.contains_weak(etag):
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+        return None
+
+    since = request.if_modified_since
+
+    if since is not None and last_modified is not None:
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+        if last_modified.replace(microsecond=0) <= since:
+            return {}, HTTPStatus.NOT_MODIFIED, headers
+
+    return None
@@ -1,7 +1,14 @@
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_uploads import UploadSet, IMAGES
 
-db = SQLAlchemy()
+from cache import ResponseCache
+from mailgun import MailQueue
+from limits import Limiter
+from routing import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()   # reads of GET requests can go to replicas, see routing.py
 jwt = JWTManager()
 image_set = UploadSet('images', IMAGES)
+cache = ResponseCache()
+mail_queue = MailQueue()
+limiter = Limiter()
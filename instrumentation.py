@@ -0,0 +1,144 @@
+import logging
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+class Timing:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.resource = None
+
+
+def resource_name():
+    """Resource class and method serving the current request, e.g. ReviewListResource.get"""
+
+    if not has_request_context():
+        return 'no request'
+
+    view = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view, 'view_class', None)
+
+    if view_class is None:
+        return request.endpoint or request.path
+
+    return '{}.{}'.format(view_class.__name__, request.method.lower())
+
+
+def current_timing():
+    return g.get('timing') if has_request_context() else None
+
+
+class RequestTimer:
+    """Counts queries and times database, serialization and handler work of every request.
+
+    The numbers go out in a Server-Timing header. Statements slower than
+    SLOW_QUERY_THRESHOLD seconds are logged with the resource that ran them,
+    and resources issuing more queries than their QUERY_BUDGETS entry are
+    logged, or fail when QUERY_BUDGET_ENFORCE is set (meant for tests).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_threshold = None
+        self.budgets = {}
+        self.enforce_budgets = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SERVER_TIMING', True)
+        self.slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD')
+        self.budgets = app.config.get('QUERY_BUDGETS', {})
+        self.enforce_budgets = app.config.get('QUERY_BUDGET_ENFORCE', False)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def start(self):
+        if self.enabled:
+            g.timing = Timing()
+
+    def add_serialize(self, seconds):
+        timing = current_timing()
+        if timing is not None:
+            timing.serialize_seconds += seconds
+
+    def budget(self, timing):
+        if timing.resource is None:
+            timing.resource = resource_name()
+        return self.budgets.get(timing.resource)
+
+    def before_query(self, statement):
+        timing = current_timing()
+
+        if timing is None:
+            return
+
+        budget = self.budget(timing)
+
+        if self.enforce_budgets and budget is not None and timing.queries >= budget:
+            raise QueryBudgetExceeded('{} issued more than {} queries, next: {}'.format(timing.resource, budget, statement))
+
+    def after_query(self, statement, seconds):
+        timing = current_timing()
+
+        if timing is not None:
+            timing.queries += 1
+            timing.query_seconds += seconds
+
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+            logger.warning('Slow query (%.1f ms) in %s: %s', seconds * 1000, resource_name(), statement)
+
+    def finish(self, response):
+        timing = current_timing()
+
+        if timing is None:
+            return response
+
+        total = time.perf_counter() - timing.started
+        budget = self.budget(timing)
+
+        if budget is not None and timing.queries > budget:
+            logger.warning('%s issued %s queries, the budget is %s', timing.resource, timing.queries, budget)
+
+        # handler time includes the database, serialization is timed separately
+        response.headers['Server-Timing'] = ', '.join((
+            'db;dur={:.2f};desc="{} queries"'.format(timing.query_seconds * 1000, timing.queries),
+            'serialize;dur={:.2f}'.format(timing.serialize_seconds * 1000),
+            'handler;dur={:.2f}'.format((total - timing.serialize_seconds) * 1000),
+            'total;dur={:.2f}'.format(total * 1000),
+        ))
+
+        return response
+
+
+request_timer = RequestTimer()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+    request_timer.before_query(statement)     # may raise, handle_error drops the start time again
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    request_timer.after_query(statement, time.perf_counter() - conn.info['query_started'].pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def handle_error(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
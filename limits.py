@@ -0,0 +1,227 @@
+import logging
+import math
+import threading
+import time
+from functools import wraps
+from http import HTTPStatus
+
+from flask import request
+from flask_jwt_extended import get_jwt_identity
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+limited_requests = registry.counter('rate_limit_requests_total', 'Requests of limited endpoints by outcome.',
+                                    labels=('limit', 'outcome'))
+admission_active = registry.gauge('admission_active_requests', 'Requests running in a limited endpoint.',
+                                  labels=('limit', ))
+admission_queued = registry.gauge('admission_queued_requests', 'Requests waiting for a limited endpoint.',
+                                  labels=('limit', ))
+
+
+class MemoryBuckets:
+    """Token buckets of one process.
+
+    Every bucket keeps the rate and burst of its limit, so the buckets of all
+    limits are pruned by their own refill. Pruning walks every bucket, it runs
+    at most once per PRUNE_INTERVAL seconds and only above MAX_CLIENTS.
+    """
+
+    MAX_CLIENTS = 10000
+    PRUNE_INTERVAL = 10
+
+    def __init__(self):
+        self.buckets = {}
+        self.next_prune = 0
+        self.lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take a token, returns (allowed, seconds until the next token)."""
+
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, updated_at, _, _ = self.buckets.get(key, (burst, now, rate, burst))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self.buckets[key] = (tokens, now, rate, burst)
+
+            if len(self.buckets) > self.MAX_CLIENTS and now >= self.next_prune:
+                self.prune(now)
+                self.next_prune = now + self.PRUNE_INTERVAL
+
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def prune(self, now):
+        # a bucket that has refilled completely is the same as no bucket
+        for key, (tokens, updated_at, rate, burst) in list(self.buckets.items()):
+            if tokens + (now - updated_at) * rate >= burst:
+                del self.buckets[key]
+
+
+class RedisBuckets:
+    """Token buckets shared by every worker, needs the optional redis package."""
+
+    SCRIPT = """
+        local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+        local updated_at = tonumber(redis.call('HGET', KEYS[1], 'updated_at'))
+        local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+
+        if tokens == nil then
+            tokens = burst
+            updated_at = now
+        end
+
+        tokens = math.min(burst, tokens + (now - updated_at) * rate)
+
+        local allowed = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+            allowed = 1
+        end
+
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+
+        return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url, prefix='review-blog:ratelimit:'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, rate, burst):
+        allowed, tokens = self.script(keys=[self.prefix + key], args=[rate, burst, time.time()])
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (1 - tokens) / rate
+
+
+class Gate:
+    """Caps concurrent requests of one endpoint, with a bounded number of waiting requests."""
+
+    def __init__(self, max_active, max_queued, timeout):
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.semaphore = threading.BoundedSemaphore(max_active)
+        self.lock = threading.Lock()
+
+        self.max_active = max_active
+        self.active = 0
+        self.queued = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.queued >= self.max_queued:
+                return False
+            self.queued += 1
+
+        try:
+            acquired = self.semaphore.acquire(timeout=self.timeout)
+        finally:
+            with self.lock:
+                self.queued -= 1
+
+        if acquired:
+            with self.lock:
+                self.active += 1
+
+        return acquired
+
+    def release(self):
+        with self.lock:
+            self.active -= 1
+        self.semaphore.release()
+
+
+class Limiter:
+    """Per-client rate limits and per-endpoint admission control for expensive resources.
+
+    Rules come from the RATE_LIMITS config, keyed by the name given to limit().
+    Endpoints without a rule are not limited.
+    """
+
+    def __init__(self):
+        self.buckets = MemoryBuckets()
+        self.rules = {}
+        self.gates = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config.get('RATE_LIMIT_REDIS_URL'):
+            self.buckets = RedisBuckets(app.config['RATE_LIMIT_REDIS_URL'])
+        else:
+            self.buckets = MemoryBuckets()
+
+        self.rules = app.config.get('RATE_LIMITS', {})
+        timeout = app.config.get('ADMISSION_TIMEOUT', 5)
+
+        self.gates = {name: Gate(rule['concurrency'], rule['queue'], timeout) for name, rule in self.rules.items()}
+        self.counters = {name: {'accepted': 0, 'rate_limited': 0, 'rejected': 0} for name in self.rules}
+
+        registry.collector(self.export_metrics)
+
+    def count(self, name, outcome):
+        with self.lock:
+            self.counters[name][outcome] += 1
+
+    def limit(self, name):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                rule = self.rules.get(name)
+
+                if rule is None:
+                    return func(*args, **kwargs)
+
+                client = get_jwt_identity() or request.remote_addr
+                allowed, retry_after = self.buckets.take('{}:{}'.format(name, client), rule['rate'], rule['burst'])
+
+                if not allowed:
+                    self.count(name, 'rate_limited')
+                    return {'message': 'Too many requests'}, HTTPStatus.TOO_MANY_REQUESTS, \
+                        {'Retry-After': str(math.ceil(retry_after))}
+
+                gate = self.gates[name]
+
+                if not gate.acquire():
+                    self.count(name, 'rejected')
+                    logger.warning('Rejected %s request, %s active and %s queued', name, gate.active, gate.queued)
+                    return {'message': 'Server is busy, try again later'}, HTTPStatus.SERVICE_UNAVAILABLE, \
+                        {'Retry-After': '1'}
+
+                self.count(name, 'accepted')
+
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    gate.release()
+
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Current limit state of every endpoint, for instrumentation."""
+
+        with self.lock:
+            return {name: dict(self.counters[name],
+                               active=self.gates[name].active,
+                               queued=self.gates[name].queued,
+                               max_active=self.gates[name].max_active,
+                               max_queued=self.gates[name].max_queued)
+                    for name in self.rules}
+
+    def export_metrics(self):
+        for name, state in self.snapshot().items():
+            for outcome in ('accepted', 'rate_limited', 'rejected'):
+                limited_requests.set(state[outcome], limit=name, outcome=outcome)
+            admission_active.set(state['active'], limit=name)
+            admission_queued.set(state['queued'], limit=name)
@@ -1,14 +1,32 @@
+import json
+import logging
+import queue
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import email_outcomes, email_retries
+
+logger = logging.getLogger(__name__)
 
 
 class MailgunApi:
 
     API_URL = 'https://api.mailgun.net/v3/{}/messages'
 
-    def __init__(self, domain, api_key):
+    def __init__(self, domain, api_key, api_url=None, timeout=10, pool_size=10):
         self.domain = domain
         self.key = api_key
-        self.base_url = self.API_URL.format(self.domain)
+        self.base_url = (api_url or self.API_URL).format(self.domain)
+        self.timeout = timeout
+
+        # one pooled session, so connections to mailgun are reused between emails
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
 
     def send_email(self, to, subject, text, html=None):
 
@@ -23,8 +41,125 @@ class MailgunApi:
             'html': html
         }
 
-        response = requests.post(url=self.base_url,
-                                 auth=('api', self.key),
-                                 data=data)
+        if len(to) > 1:
+            # with recipient variables mailgun sends every recipient their own copy
+            data['recipient-variables'] = json.dumps({address: {} for address in to})
+
+        response = self.session.post(url=self.base_url,
+                                     auth=('api', self.key),
+                                     data=data,
+                                     timeout=self.timeout)
 
         return response
+
+
+class MailQueue:
+    """Sends emails from background worker threads.
+
+    send_email() only enqueues the email. Workers merge queued emails with the
+    same content into one mailgun request and retry failed requests with
+    exponential backoff. At most MAIL_QUEUE_SIZE emails wait, further ones are
+    dropped and logged instead of piling up while mailgun is down.
+    """
+
+    MAX_RECIPIENTS = 1000   # mailgun limit per request
+
+    def __init__(self):
+        self.api = None
+        self.worker_count = 4
+        self.batch_size = 50
+        self.max_retries = 5
+        self.backoff = 0.5
+
+        self.queue = queue.Queue(maxsize=10000)
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.api = MailgunApi(domain=app.config.get('MAILGUN_DOMAIN'),
+                              api_key=app.config.get('MAILGUN_API_KEY'),
+                              api_url=app.config.get('MAILGUN_API_URL'),
+                              timeout=app.config.get('MAIL_TIMEOUT', 10),
+                              pool_size=app.config.get('MAIL_WORKERS', 4))
+
+        self.worker_count = app.config.get('MAIL_WORKERS', 4)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 50)
+        self.max_retries = app.config.get('MAIL_MAX_RETRIES', 5)
+        self.backoff = app.config.get('MAIL_RETRY_BACKOFF', 0.5)
+        self.queue = queue.Queue(maxsize=app.config.get('MAIL_QUEUE_SIZE', 10000))
+
+    def send_email(self, to, subject, text, html=None):
+
+        if not isinstance(to, (list, tuple)):
+            to = [to, ]
+
+        self.start()
+
+        try:
+            self.queue.put_nowait((list(to), subject, text, html))
+        except queue.Full:
+            logger.error('Mail queue is full, dropping email to %s', to)
+            email_outcomes.inc(len(to), outcome='dropped')
+
+    def start(self):
+        with self.lock:
+            # a worker that died is replaced
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+
+            while len(self.workers) < self.worker_count:
+                worker = threading.Thread(target=self.work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        while True:
+            jobs = [self.queue.get()]
+
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self.deliver_batch(jobs)
+            except Exception:
+                # the worker keeps running, the rest of the batch is not sent
+                logger.exception('Sending a batch of %s emails failed', len(jobs))
+            finally:
+                for _ in jobs:
+                    self.queue.task_done()
+
+    def deliver_batch(self, jobs):
+        groups = {}
+        for to, subject, text, html in jobs:
+            groups.setdefault((subject, text, html), []).extend(to)
+
+        for (subject, text, html), recipients in groups.items():
+            for i in range(0, len(recipients), self.MAX_RECIPIENTS):
+                self.deliver(recipients[i:i + self.MAX_RECIPIENTS], subject, text, html)
+
+    def deliver(self, to, subject, text, html):
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.api.send_email(to=to, subject=subject, text=text, html=html)
+
+                if response.status_code < 500 and response.status_code != 429:
+                    if response.status_code >= 400:
+                        logger.error('Mailgun rejected email to %s: %s', to, response.text)
+                        email_outcomes.inc(len(to), outcome='rejected')
+                    else:
+                        email_outcomes.inc(len(to), outcome='sent')
+                    return response
+
+                logger.warning('Mailgun returned %s, attempt %s', response.status_code, attempt + 1)
+
+            except requests.RequestException as e:
+                logger.warning('Sending email failed, attempt %s: %s', attempt + 1, e)
+
+            if attempt < self.max_retries:
+                email_retries.inc()
+                time.sleep(self.backoff * 2 ** attempt)
+
+        logger.error('Giving up sending email to %s', to)
+        email_outcomes.inc(len(to), outcome='failed')
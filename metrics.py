@@ -0,0 +1,324 @@
+import atexit
+import glob
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in labels)
+    return '{' + ','.join('{}="{}"'.format(name, value) for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Metric:
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def key(self, labels):
+        return tuple((name, str(labels[name])) for name in self.label_names)
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.name, self.key(labels), amount)
+
+    def set(self, value, **labels):
+        # for totals counted elsewhere in this process, e.g. by the limiter
+        self.registry.put(self.name, self.key(labels), value)
+
+
+class Gauge(Metric):
+    """Value of this process, summed over the processes that are still running."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.registry.put(self.name, self.key(labels), value)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        self.registry.observe(self.name, self.key(labels), bisect_left(self.buckets, value), len(self.buckets), value)
+
+
+class Registry:
+    """Metrics of this process, optionally shared with the other workers through files.
+
+    Without METRICS_DIR the values live in memory and /metrics shows this
+    process only. With it every process writes its values to its own file
+    at most every METRICS_FLUSH_INTERVAL seconds, and /metrics adds up the
+    files of all processes. Counters and histograms of exited workers are
+    kept so totals never go back, their gauges are dropped.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.directory = None
+        self.flush_interval = 1
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.values = {}        # (name, labels) -> value
+        self.histograms = {}    # (name, labels) -> [bucket counts, sum]
+        self.flusher = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_DIR')
+        self.flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 1)
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def counter(self, name, documentation, labels=()):
+        return self.metrics.setdefault(name, Counter(self, name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.metrics.setdefault(name, Gauge(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.metrics.setdefault(name, Histogram(self, name, documentation, labels, buckets))
+
+    def collector(self, func):
+        """Registers a function that updates gauges and counters right before they are read."""
+        if func not in self.collectors:
+            self.collectors.append(func)
+        return func
+
+    def check_process(self):
+        # a forked worker starts from zero instead of repeating the counts of its parent
+        if self.pid != os.getpid():
+            self.reset()
+
+        if self.directory and self.flusher is None:
+            with self.lock:
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+                    self.flusher.start()
+
+    def add(self, name, key, amount):
+        self.check_process()
+        with self.lock:
+            self.values[(name, key)] = self.values.get((name, key), 0) + amount
+
+    def put(self, name, key, value):
+        self.check_process()
+        with self.lock:
+            self.values[(name, key)] = value
+
+    def observe(self, name, key, bucket, bucket_count, value):
+        self.check_process()
+        with self.lock:
+            histogram = self.histograms.get((name, key))
+            if histogram is None:
+                histogram = self.histograms[(name, key)] = [[0] * bucket_count, 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += value
+
+    def collect(self):
+        for func in self.collectors:
+            func()
+
+    def snapshot(self):
+        with self.lock:
+            return {'pid': self.pid,
+                    'values': [[name, key, value] for (name, key), value in self.values.items()],
+                    'histograms': [[name, key, counts, total] for (name, key), (counts, total) in self.histograms.items()]}
+
+    def path(self, pid):
+        return os.path.join(self.directory, 'metrics-{}.json'.format(pid))
+
+    def flush(self):
+        if not self.directory or self.pid != os.getpid():
+            return
+
+        self.collect()
+        path = self.path(self.pid)
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+
+        with open(temporary, 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, path)     # readers never see half a file
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def snapshots(self):
+        if not self.directory:
+            self.collect()
+            return [(self.snapshot(), True)]
+
+        self.flush()
+        snapshots = []
+
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((snapshot, process_alive(snapshot['pid'])))
+
+        return snapshots
+
+    def merged(self):
+        values, histograms = {}, {}
+
+        for snapshot, alive in self.snapshots():
+            for name, key, value in snapshot['values']:
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                key = tuple(tuple(pair) for pair in key)
+                values[(name, key)] = values.get((name, key), 0) + value
+
+            for name, key, counts, total in snapshot['histograms']:
+                key = tuple(tuple(pair) for pair in key)
+                merged = histograms.setdefault((name, key), [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+
+        return values, histograms
+
+    def exposition(self):
+        """All metrics in the prometheus text format."""
+
+        values, histograms = self.merged()
+        lines = []
+
+        for name, metric in sorted(self.metrics.items()):
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.kind))
+
+            if metric.kind != 'histogram':
+                for (sample, key), value in sorted(values.items()):
+                    if sample == name:
+                        lines.append('{}{} {}'.format(name, format_labels(key), format_value(value)))
+                continue
+
+            for (sample, key), (counts, total) in sorted(histograms.items()):
+                if sample != name:
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets, counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(key + (('le', format_value(bound)),)),
+                                                          cumulative))
+                lines.append('{}_sum{} {}'.format(name, format_labels(key), format_value(total)))
+                lines.append('{}_count{} {}'.format(name, format_labels(key), cumulative))
+
+        return '\n'.join(lines) + '\n'
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = Registry()
+
+request_count = registry.counter('http_requests_total', 'Requests by route, method and status.',
+                                 labels=('route', 'method', 'status'))
+request_duration = registry.histogram('http_request_duration_seconds', 'Request latency by route and method.',
+                                      labels=('route', 'method'))
+pool_checkout_wait = registry.histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection.',
+                                        labels=('pool', ), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+image_duration = registry.histogram('image_processing_seconds', 'Avatar processing time by stage and outcome.',
+                                    labels=('stage', 'outcome'))
+email_outcomes = registry.counter('email_recipients_total', 'Email recipients by delivery outcome.',
+                                  labels=('outcome', ))
+email_retries = registry.counter('email_retries_total', 'Mailgun calls that were retried.')
+
+
+def watch_pool(pool, name='primary'):
+    """Times every connection checkout of the pool, waiting for a free connection included."""
+
+    if getattr(pool, 'checkout_timed', False):
+        return
+
+    connect = pool.connect
+
+    def timed_connect():
+        start = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - start, pool=name)
+
+    pool.connect = timed_connect
+    pool.checkout_timed = True
+
+
+class RequestMetrics:
+
+    def init_app(self, app):
+        registry.init_app(app)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.add_url_rule('/metrics', 'metrics', self.export)
+
+    def start(self):
+        g.metrics_started = time.perf_counter()
+
+    def finish(self, response):
+        started = g.get('metrics_started')
+
+        if started is None or request.endpoint == 'metrics':
+            return response
+
+        # the url rule, not the path, so ids do not turn into separate series
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+        request_count.inc(route=route, method=request.method, status=response.status_code)
+        request_duration.observe(time.perf_counter() - started, route=route, method=request.method)
+
+        return response
+
+    def export(self):
+        return Response(registry.exposition(), mimetype='text/plain; version=0.0.4')
+
+
+request_metrics = RequestMetrics()
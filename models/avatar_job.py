@@ -0,0 +1,41 @@
+from datetime import datetime
+
+from extensions import db
+from unit_of_work import unit_of_work
+
+
+class AvatarJob(db.Model):
+    """Status of an avatar upload, polled from whichever worker the client reaches."""
+
+    __tablename__ = 'avatar_job'
+
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(10), nullable=False, default='pending')
+    variants = db.Column(db.JSON())     # {size: {ext: filename}} once done
+
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now(),
+                           index=True)
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now(),
+                           onupdate=datetime.utcnow)
+
+    user_id = db.Column(db.Integer(), db.ForeignKey("user.id"), nullable=False)
+
+    @classmethod
+    def get_by_id(cls, job_id):
+        return cls.query.filter_by(id=job_id).first()
+
+    @classmethod
+    def fail(cls, job_id):
+        cls.query.filter_by(id=job_id, status='pending').update({cls.status: 'failed'}, synchronize_session=False)
+        unit_of_work.commit()
+
+    @classmethod
+    def delete_created_before(cls, before):
+        deleted = cls.query.filter(cls.created_at < before).delete(synchronize_session=False)
+        unit_of_work.commit()
+
+        return deleted
+
+    def save(self):
+        db.session.add(self)
+        unit_of_work.commit()
@@ -1,8 +1,20 @@
+from datetime import datetime
+
 from extensions import db
+from models.review import Review
+from models.rows import CommentRow, to_rows
+from models.user import User
+from pagination import paginate
+from unit_of_work import unit_of_work
 
 
 class Comment(db.Model):
     __tablename__ = 'comment'
+    __table_args__ = (
+        # keyset pages of a review's published comments and of one user's comments
+        db.Index('ix_comment_review_publish_created', 'review_id', 'is_publish', 'created_at', 'id'),
+        db.Index('ix_comment_user_publish_created', 'user_id', 'is_publish', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -10,32 +22,141 @@ class Comment(db.Model):
     review_helpful = db.Column(db.Boolean(), default=True)
 
     is_publish = db.Column(db.Boolean(), default=False)
-    created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
-    updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now(),
+                           onupdate=datetime.utcnow)
 
     user_id = db.Column(db.Integer(), db.ForeignKey("user.id"))
     review_id = db.Column(db.Integer(), db.ForeignKey("review.id"))
 
+    @classmethod
+    def with_author(cls):
+        # author is nested in every dump, load it in the same query instead of one query per row
+        return cls.query.options(db.joinedload(cls.user))
+
     @classmethod
     def get_all_published(cls):
-        return cls.query.filter_by(is_publish=True).all()
+        return cls.with_author().filter_by(is_publish=True).all()
+
+    @classmethod
+    def published_comments_query(cls, review_id):
+        return cls.with_author().filter_by(is_publish=True, review_id=review_id)
 
     @classmethod
     def get_all_published_comments(cls, review_id):  # review id so we can find all comments of a review
-        return cls.query.filter_by(is_publish=True, review_id=review_id).all()
+        return cls.published_comments_query(review_id).all()
+
+    @classmethod
+    def get_published_comments_page(cls, review_id, sort='newest', limit=20, cursor=None):
+        return paginate(cls.published_comments_query(review_id), cls, sort=sort, limit=limit, cursor=cursor)
 
     @classmethod
     def get_all_by_user(cls, user_id, visibility='public'):
-        return cls.query.filter_by(user_id=user_id).all()
+        return cls.by_user_query(user_id, visibility).all()
+
+    @classmethod
+    def get_page_by_user(cls, user_id, visibility='public', sort='newest', limit=20, cursor=None):
+        return paginate(cls.by_user_query(user_id, visibility), cls, sort=sort, limit=limit, cursor=cursor)
+
+    @classmethod
+    def by_user_query(cls, user_id, visibility='public'):
+        return cls.with_author().filter(*cls.by_user_filter(user_id, visibility))
+
+    @classmethod
+    def by_user_filter(cls, user_id, visibility='public'):
+        if visibility == 'public':
+            return [cls.user_id == user_id, cls.is_publish == True]
+
+        elif visibility == 'private':
+            return [cls.user_id == user_id, cls.is_publish == False]
+
+        else:
+            return [cls.user_id == user_id]
+
+    @classmethod
+    def rows_query(cls):
+        # only the columns the list schemas dump, as tuples outside the identity map
+        return db.session.query(cls.id, cls.review_id, cls.content, cls.review_helpful, cls.is_publish,
+                                cls.created_at, cls.updated_at, *User.author_columns()) \
+            .outerjoin(User, cls.user_id == User.id)
+
+    @classmethod
+    def published_comment_rows_query(cls, review_id):
+        return cls.rows_query().filter(cls.is_publish == True, cls.review_id == review_id)
+
+    @classmethod
+    def rows_by_user_query(cls, user_id, visibility='public'):
+        return cls.rows_query().filter(*cls.by_user_filter(user_id, visibility))
+
+    @classmethod
+    def get_published_comment_rows_page(cls, review_id, sort='newest', limit=20, cursor=None):
+        rows, next_cursor = paginate(cls.published_comment_rows_query(review_id), cls,
+                                     sort=sort, limit=limit, cursor=cursor)
+        return to_rows(CommentRow, rows), next_cursor
+
+    @classmethod
+    def get_rows_page_by_user(cls, user_id, visibility='public', sort='newest', limit=20, cursor=None):
+        rows, next_cursor = paginate(cls.rows_by_user_query(user_id, visibility), cls,
+                                     sort=sort, limit=limit, cursor=cursor)
+        return to_rows(CommentRow, rows), next_cursor
+
+    @classmethod
+    def get_commented_review_ids(cls, user_id):
+        return [row.review_id for row in db.session.query(cls.review_id).filter_by(user_id=user_id).distinct()]
 
     @classmethod
     def get_by_id(cls, comment_id):
-        return cls.query.filter_by(id=comment_id).first()
+        return cls.by_id_query(comment_id).first()
+
+    @classmethod
+    def by_id_query(cls, comment_id):
+        return cls.query.filter_by(id=comment_id)
+
+    @classmethod
+    def purge_batch_query(cls, review_id, batch_size=500):
+        # ids of the next comments Review.purge deletes
+        return db.session.query(cls.id).filter_by(review_id=review_id).limit(batch_size)
 
     def save(self):
         db.session.add(self)
+        unit_of_work.commit()
+
+    def publish(self):
+        self.set_publish(True)
+
+    def unpublish(self):
+        self.set_publish(False)
+
+    def set_publish(self, is_publish):
+        # conditional update, so only the request that actually flips the state touches the counter
+        changed = Comment.query.filter_by(id=self.id, is_publish=not is_publish) \
+            .update({Comment.is_publish: is_publish}, synchronize_session=False)
+
+        if changed:
+            self.change_review_counter(1 if is_publish else -1)
+
+        unit_of_work.commit()
+
+    def change_review_counter(self, delta):
+        Review.query.filter_by(id=self.review_id) \
+            .update({Review.comments: db.func.coalesce(Review.comments, 0) + delta}, synchronize_session=False)
+
+    @classmethod
+    def recount_review_comments(cls):
+        # repairs drifted counters of every review with a single aggregate update
+        published = db.session.query(db.func.count(cls.id)) \
+            .filter(cls.review_id == Review.id, cls.is_publish == True) \
+            .correlate(Review) \
+            .as_scalar()
+
+        updated = Review.query.update({Review.comments: published}, synchronize_session=False)
         db.session.commit()
 
+        return updated
+
     def delete(self):
+        if self.is_publish:
+            self.change_review_counter(-1)
+
         db.session.delete(self)
-        db.session.commit()
\ No newline at end of file
+        unit_of_work.commit()
@@ -1,8 +1,25 @@
+import threading
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
 from extensions import db
+from models.rows import ReviewRow, to_rows
+from models.user import User
+from pagination import paginate, keyset_filter, decode_rank_cursor, encode_cursor
+from unit_of_work import unit_of_work
 
 
 class Review(db.Model):
     __tablename__ = 'review'
+    __table_args__ = (
+        db.Index('ix_review_search_vector', 'search_vector', postgresql_using='gin'),
+        # keyset pages of published reviews and of one user's reviews
+        db.Index('ix_review_publish_created', 'is_publish', 'created_at', 'id'),
+        db.Index('ix_review_user_publish_created', 'user_id', 'is_publish', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -12,34 +29,193 @@ class Review(db.Model):
     comments = db.Column(db.Integer)
 
     is_publish = db.Column(db.Boolean(), default=False)
-    created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
-    updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    is_deleted = db.Column(db.Boolean(), nullable=False, default=False, server_default=db.false())
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now(),
+                           onupdate=datetime.utcnow)
 
     user_id = db.Column(db.Integer(), db.ForeignKey("user.id"))
 
+    # full text of title and content, kept current on save on postgres (plain text column on sqlite)
+    search_vector = db.Column(TSVECTOR().with_variant(db.Text(), 'sqlite'))
+
+    @classmethod
+    def with_author(cls):
+        # author is nested in every dump, load it in the same query instead of one query per row
+        return cls.query.options(db.joinedload(cls.user))
+
+    @classmethod
+    def published_query(cls):
+        return cls.with_author().filter_by(is_publish=True)
+
     @classmethod
     def get_all_published(cls):
-        return cls.query.filter_by(is_publish=True).all()
+        return cls.published_query().all()
+
+    @classmethod
+    def get_published_page(cls, sort='newest', limit=20, cursor=None):
+        return paginate(cls.published_query(), cls, sort=sort, limit=limit, cursor=cursor)
 
     @classmethod
     def get_all_by_user(cls, user_id, visibility='public'):
+        return cls.by_user_query(user_id, visibility).all()
+
+    @classmethod
+    def get_page_by_user(cls, user_id, visibility='public', sort='newest', limit=20, cursor=None):
+        return paginate(cls.by_user_query(user_id, visibility), cls, sort=sort, limit=limit, cursor=cursor)
+
+    @classmethod
+    def by_user_query(cls, user_id, visibility='public'):
+        return cls.with_author().filter(*cls.by_user_filter(user_id, visibility))
+
+    @classmethod
+    def by_user_filter(cls, user_id, visibility='public'):
         if visibility == 'public':
-            return cls.query.filter_by(user_id=user_id, is_publish=True).all()
+            return [cls.user_id == user_id, cls.is_publish == True]
 
         elif visibility == 'private':
-            return cls.query.filter_by(user_id=user_id, is_publish=False).all()
+            return [cls.user_id == user_id, cls.is_publish == False, cls.is_deleted == False]
 
         else:
-            return cls.query.filter_by(user_id=user_id).all()
+            return [cls.user_id == user_id, cls.is_deleted == False]
+
+    @classmethod
+    def rows_query(cls):
+        # only the columns the list schemas dump, as tuples outside the identity map
+        return db.session.query(cls.id, cls.title, cls.content, cls.rating, cls.comments, cls.is_publish,
+                                cls.created_at, cls.updated_at, *User.author_columns()) \
+            .outerjoin(User, cls.user_id == User.id)
+
+    @classmethod
+    def published_rows_query(cls):
+        return cls.rows_query().filter(cls.is_publish == True)
+
+    @classmethod
+    def rows_by_user_query(cls, user_id, visibility='public'):
+        return cls.rows_query().filter(*cls.by_user_filter(user_id, visibility))
+
+    @classmethod
+    def get_all_published_rows(cls):
+        return to_rows(ReviewRow, cls.published_rows_query())
+
+    @classmethod
+    def get_published_rows_page(cls, sort='newest', limit=20, cursor=None):
+        rows, next_cursor = paginate(cls.published_rows_query(), cls, sort=sort, limit=limit, cursor=cursor)
+        return to_rows(ReviewRow, rows), next_cursor
+
+    @classmethod
+    def get_rows_page_by_user(cls, user_id, visibility='public', sort='newest', limit=20, cursor=None):
+        rows, next_cursor = paginate(cls.rows_by_user_query(user_id, visibility), cls,
+                                     sort=sort, limit=limit, cursor=cursor)
+        return to_rows(ReviewRow, rows), next_cursor
+
+    @classmethod
+    def search_document(cls, title, content):
+        # title matches rank above content matches
+        return db.func.setweight(db.func.to_tsvector('english', db.func.coalesce(title, '')), 'A') \
+            .op('||')(db.func.setweight(db.func.to_tsvector('english', db.func.coalesce(content, '')), 'B'))
+
+    @classmethod
+    def search_query(cls, q, limit=20, cursor=None):
+        ts_query = db.func.plainto_tsquery('english', q)
+        # ts_rank is a float4, the cursor keeps it as a python float, compare both as float8
+        rank = db.cast(db.func.ts_rank(cls.search_vector, ts_query), db.Float)
+
+        query = cls.with_author().add_columns(rank) \
+            .filter(cls.is_publish == True, cls.search_vector.op('@@')(ts_query))
+
+        if cursor:
+            query = query.filter(keyset_filter([rank, cls.id], decode_rank_cursor(cursor), descending=True))
+
+        return query.order_by(rank.desc(), cls.id.desc()).limit(limit + 1)
+
+    @classmethod
+    def search_page(cls, q, limit=20, cursor=None):
+        # postgres only, see search.search_reviews for the other databases
+        rows = cls.search_query(q, limit=limit, cursor=cursor).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor([rows[-1][1], rows[-1][0].id])
+
+        return [review for review, _ in rows], next_cursor
+
+    @classmethod
+    def reindex(cls):
+        cls.query.update({cls.search_vector: cls.search_document(cls.title, cls.content)}, synchronize_session=False)
+        db.session.commit()
 
     @classmethod
     def get_by_id(cls, review_id):
-        return cls.query.filter_by(id=review_id).first()
+        return cls.by_id_query(review_id).first()
+
+    @classmethod
+    def by_id_query(cls, review_id):
+        return cls.query.filter_by(id=review_id, is_deleted=False)
+
+    @classmethod
+    def get_ids_by_user(cls, user_id):
+        return [row.id for row in db.session.query(cls.id).filter_by(user_id=user_id)]
+
+    @classmethod
+    def get_all_deleted_ids(cls):
+        return [row.id for row in db.session.query(cls.id).filter_by(is_deleted=True)]
 
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        unit_of_work.commit()
 
     def delete(self):
+        # imported here because models.comment imports this module
+        from models.comment import Comment
+
+        # published and unpublished comments go with one statement, in the same transaction as the review
+        Comment.query.filter_by(review_id=self.id).delete(synchronize_session=False)
         db.session.delete(self)
+        unit_of_work.commit()
+
+    def mark_deleted(self):
+        # hidden from every query right away, the rows are removed later by purge()
+        self.is_deleted = True
+        self.is_publish = False
+        self.save()
+
+    @classmethod
+    def purge(cls, review_id, batch_size=500):
+        from models.comment import Comment
+
+        while True:
+            ids = [row.id for row in Comment.purge_batch_query(review_id, batch_size)]
+
+            if not ids:
+                break
+
+            Comment.query.filter(Comment.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()     # short transactions, so locks are released between batches
+
+        cls.query.filter_by(id=review_id, is_deleted=True).delete(synchronize_session=False)
         db.session.commit()
+
+    @classmethod
+    def purge_in_background(cls, review_id):
+        app = current_app._get_current_object()
+        batch_size = app.config.get('REVIEW_PURGE_BATCH_SIZE', 500)
+
+        def run():
+            with app.app_context():
+                cls.purge(review_id, batch_size=batch_size)
+
+        # purge() only removes reviews whose delete mark is committed
+        unit_of_work.after_commit(threading.Thread(target=run, daemon=True).start)
+
+
+# pages sorted by rating order by the same expression as pagination.sort_columns
+db.Index('ix_review_publish_rating', Review.is_publish, db.func.coalesce(Review.rating, 0), Review.created_at, Review.id)
+
+
+@event.listens_for(Review, 'before_insert')
+@event.listens_for(Review, 'before_update')
+def update_search_vector(mapper, connection, target):
+    if connection.dialect.name == 'postgresql':
+        target.search_vector = Review.search_document(target.title, target.content)
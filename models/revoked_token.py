@@ -0,0 +1,30 @@
+from datetime import datetime
+
+from extensions import db
+from unit_of_work import unit_of_work
+
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_token'
+
+    jti = db.Column(db.String(36), primary_key=True)
+    expires_at = db.Column(db.DateTime(), nullable=False, index=True)
+
+    @classmethod
+    def is_revoked(cls, jti):
+        return cls.query.filter(cls.jti == jti, cls.expires_at > datetime.utcnow()).first() is not None
+
+    @classmethod
+    def get_all_active_jtis(cls):
+        return [row.jti for row in db.session.query(cls.jti).filter(cls.expires_at > datetime.utcnow())]
+
+    @classmethod
+    def delete_expired(cls):
+        deleted = cls.query.filter(cls.expires_at <= datetime.utcnow()).delete(synchronize_session=False)
+        unit_of_work.commit()
+
+        return deleted
+
+    def save(self):
+        db.session.merge(self)
+        unit_of_work.commit()
@@ -0,0 +1,50 @@
+class AuthorRow:
+    __slots__ = ('id', 'username', 'avatar_image', 'created_at', 'updated_at')
+
+    def __init__(self, id, username, avatar_image, created_at, updated_at):
+        self.id = id
+        self.username = username
+        self.avatar_image = avatar_image
+        self.created_at = created_at
+        self.updated_at = updated_at
+
+
+def author(id, username, avatar_image, created_at, updated_at):
+    return None if id is None else AuthorRow(id, username, avatar_image, created_at, updated_at)
+
+
+class ReviewRow:
+    """Read-only review of a list page, with the same attributes the review schemas dump."""
+
+    __slots__ = ('id', 'title', 'content', 'rating', 'comments', 'is_publish', 'created_at', 'updated_at', 'user')
+
+    def __init__(self, id, title, content, rating, comments, is_publish, created_at, updated_at, *user):
+        self.id = id
+        self.title = title
+        self.content = content
+        self.rating = rating
+        self.comments = comments
+        self.is_publish = is_publish
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.user = author(*user)
+
+
+class CommentRow:
+    """Read-only comment of a list page, with the same attributes the comment schemas dump."""
+
+    __slots__ = ('id', 'review_id', 'content', 'review_helpful', 'is_publish', 'created_at', 'updated_at', 'user')
+
+    def __init__(self, id, review_id, content, review_helpful, is_publish, created_at, updated_at, *user):
+        self.id = id
+        self.review_id = review_id
+        self.content = content
+        self.review_helpful = review_helpful
+        self.is_publish = is_publish
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.user = author(*user)
+
+
+def to_rows(row_class, rows):
+    return [row_class(*row) for row in rows]
@@ -1,34 +1,79 @@
+from datetime import datetime
+
 from extensions import db
+from unit_of_work import unit_of_work
 
 
 class User(db.Model):
     __tablename__ = 'user'
+    __table_args__ = (
+        # lets postgres answer LIKE 'prefix%' from the index whatever the collation
+        db.Index('ix_user_username_prefix', 'username', postgresql_ops={'username': 'text_pattern_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), nullable=False, unique=True)
     email = db.Column(db.String(200), nullable=False, unique=True)
     password = db.Column(db.String(200))
     is_active = db.Column(db.Boolean(), default=False)
-    avatar_image = db.Column(db.String(100), default=None)
+    avatar_image = db.Column(db.String(100), default=None, index=True)     # avatar_in_use() runs on every avatar change
 
-    created_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now())
-    updated_at = db.Column(db.DateTime(), nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+    created_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(), nullable=False, default=datetime.utcnow, server_default=db.func.now(),
+                           onupdate=datetime.utcnow)
 
     reviews = db.relationship('Review', backref='user')
     comments = db.relationship('Comment', backref='user')
 
     @classmethod
     def get_by_username(cls, username):
-        return cls.query.filter_by(username=username).first()
+        return cls.by_username_query(username).first()
+
+    @classmethod
+    def by_username_query(cls, username):
+        return cls.query.filter_by(username=username)
+
+    @classmethod
+    def search_by_prefix(cls, prefix, limit=10):
+        return cls.prefix_query(prefix, limit=limit).all()
+
+    @classmethod
+    def prefix_query(cls, prefix, limit=10):
+        return db.session.query(cls.id, cls.username, cls.avatar_image) \
+            .filter(cls.username.startswith(prefix, autoescape=True), cls.is_active == True) \
+            .order_by(cls.username) \
+            .limit(limit)
+
+    @classmethod
+    def author_columns(cls):
+        # nested as author in review and comment rows, labeled apart from the columns of the row itself
+        return (cls.id.label('author_id'), cls.username, cls.avatar_image,
+                cls.created_at.label('author_created_at'), cls.updated_at.label('author_updated_at'))
 
     @classmethod
     def get_by_email(cls, email):
-        return cls.query.filter_by(email=email).first()
+        return cls.by_email_query(email).first()
+
+    @classmethod
+    def by_email_query(cls, email):
+        return cls.query.filter_by(email=email)
 
     @classmethod
     def get_by_id(cls, id):
-        return cls.query.filter_by(id=id).first()
+        return cls.by_id_query(id).first()
+
+    @classmethod
+    def by_id_query(cls, id):
+        return cls.query.filter_by(id=id)
+
+    @classmethod
+    def avatar_in_use(cls, avatar_image):
+        return cls.by_avatar_query(avatar_image).first() is not None
+
+    @classmethod
+    def by_avatar_query(cls, avatar_image):
+        return cls.query.filter_by(avatar_image=avatar_image)
 
     def save(self):
         db.session.add(self)
-        db.session.commit()
+        unit_of_work.commit()
@@ -0,0 +1,132 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from marshmallow import validate
+from webargs import fields
+
+from extensions import db
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+REVIEW_SORTS = ('newest', 'oldest', 'rating')
+COMMENT_SORTS = ('newest', 'oldest')
+
+review_page_args = {
+    'limit': fields.Int(missing=DEFAULT_LIMIT, validate=validate.Range(min=1, max=MAX_LIMIT)),
+    'cursor': fields.Str(missing=None),
+    'sort': fields.Str(missing='newest', validate=validate.OneOf(REVIEW_SORTS))
+}
+
+comment_page_args = dict(review_page_args, sort=fields.Str(missing='newest', validate=validate.OneOf(COMMENT_SORTS)))
+
+username_search_args = {
+    'prefix': fields.Str(required=True, validate=validate.Length(min=1, max=80)),
+    'limit': fields.Int(missing=10, validate=validate.Range(min=1, max=20))
+}
+
+search_args = {
+    'q': fields.Str(required=True, validate=validate.Length(min=1, max=256)),
+    'limit': review_page_args['limit'],
+    'cursor': fields.Str(missing=None)
+}
+
+
+def encode_cursor(key):
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def load_cursor(cursor, length):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        key = json.loads(raw.decode())
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(key, list) or len(key) != length:
+        raise ValueError('Invalid cursor')
+
+    return key
+
+
+def is_number(value):
+    # json true and false load as ints, the database would get booleans
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor, sort):
+    key = load_cursor(cursor, 3 if sort == 'rating' else 2)
+
+    try:
+        key[-2] = datetime.fromisoformat(key[-2])   # key always ends with (created_at, id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+    if not is_id(key[-1]):
+        raise ValueError('Invalid cursor')
+
+    if sort == 'rating' and not is_number(key[0]):
+        raise ValueError('Invalid cursor')
+
+    return key
+
+
+def decode_rank_cursor(cursor):
+    rank, item_id = load_cursor(cursor, 2)
+
+    if not is_number(rank) or not is_id(item_id):
+        raise ValueError('Invalid cursor')
+
+    return rank, item_id
+
+
+def sort_columns(model, sort):
+    columns = [model.created_at, model.id]
+    if sort == 'rating':
+        columns.insert(0, db.func.coalesce(model.rating, 0))
+    return columns
+
+
+def row_key(item, sort):
+    key = [item.created_at.isoformat(), item.id]
+    if sort == 'rating':
+        key.insert(0, item.rating or 0)
+    return key
+
+
+def keyset_filter(columns, values, descending):
+    # row value comparison, postgres turns it into a range scan of the matching composite index
+    if descending:
+        return db.tuple_(*columns) < db.tuple_(*values)
+    return db.tuple_(*columns) > db.tuple_(*values)
+
+
+def page_query(query, model, sort='newest', limit=DEFAULT_LIMIT, cursor=None):
+    columns = sort_columns(model, sort)
+    descending = sort != 'oldest'
+
+    if cursor:
+        query = query.filter(keyset_filter(columns, decode_cursor(cursor, sort), descending))
+
+    order = [c.desc() if descending else c.asc() for c in columns]
+    return query.order_by(*order).limit(limit + 1)
+
+
+def paginate(query, model, sort='newest', limit=DEFAULT_LIMIT, cursor=None):
+    """Return one page of the query and the cursor of the next page (None on the last page)."""
+
+    items = page_query(query, model, sort=sort, limit=limit, cursor=cursor).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(row_key(items[-1], sort))
+
+    return items, next_cursor
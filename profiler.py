@@ -0,0 +1,137 @@
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+from instrumentation import resource_name
+
+
+def collapse(frame):
+    """Stack of the frame in collapsed format, outermost call first."""
+
+    names = []
+    while frame is not None:
+        names.append('{}:{}'.format(frame.f_globals.get('__name__', '?'), frame.f_code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    """Samples the call stacks of selected requests and adds them up per resource.
+
+    Off unless PROFILER_ENABLED is set; then no hook is even registered. A
+    request is profiled when it sends PROFILE_TOKEN in the X-Profile header,
+    or as one in every PROFILE_SAMPLE_EVERY requests when that is set. A
+    sampler thread reads the stack of every profiled request each
+    PROFILE_INTERVAL seconds and the stacks are written to
+    PROFILE_DIR/<resource>.<pid>.folded, ready for flamegraph.pl or speedscope.
+    """
+
+    HEADER = 'X-Profile'
+
+    def __init__(self):
+        self.token = None
+        self.sample_every = None
+        self.interval = 0.005
+        self.directory = None
+
+        self.requests = itertools.count(1)
+        self.active = {}        # thread id -> samples of the request it is serving
+        self.stacks = {}        # resource -> Counter of collapsed stacks
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.sampler = None
+
+    def init_app(self, app):
+        if not app.config.get('PROFILER_ENABLED'):
+            return
+
+        self.token = app.config.get('PROFILE_TOKEN')
+        self.sample_every = app.config.get('PROFILE_SAMPLE_EVERY')
+        self.interval = app.config.get('PROFILE_INTERVAL', 0.005)
+        self.directory = app.config.get('PROFILE_DIR', 'profiles')
+        os.makedirs(self.directory, exist_ok=True)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        app.teardown_request(self.stop)
+
+    def selected(self):
+        token = request.headers.get(self.HEADER)
+
+        if token and self.token and hmac.compare_digest(token, self.token):
+            return True
+
+        return bool(self.sample_every) and next(self.requests) % self.sample_every == 0
+
+    def start(self):
+        if not self.selected():
+            return
+
+        g.profile = Counter()
+
+        with self.lock:
+            self.active[threading.get_ident()] = g.profile
+
+            if self.sampler is None:
+                self.sampler = threading.Thread(target=self.sample, daemon=True)
+                self.sampler.start()
+
+        self.wake.set()
+
+    def sample(self):
+        while True:
+            self.wake.wait()
+            time.sleep(self.interval)
+
+            frames = sys._current_frames()
+
+            with self.lock:
+                for thread_id, samples in self.active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+
+                if not self.active:
+                    self.wake.clear()
+
+    def stop(self, exception=None):
+        # requests that failed before after_request stop being sampled as well
+        if 'profile' in g:
+            with self.lock:
+                self.active.pop(threading.get_ident(), None)
+
+    def finish(self, response):
+        samples = g.get('profile')
+
+        if samples is None:
+            return response
+
+        resource = resource_name()
+
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+            stacks = self.stacks.setdefault(resource, Counter())
+            stacks.update(samples)
+            lines = ['{} {}\n'.format(stack, count) for stack, count in stacks.items()]
+
+        self.write(resource, lines)
+        response.headers['X-Profile-Samples'] = str(sum(samples.values()))
+
+        return response
+
+    def write(self, resource, lines):
+        path = os.path.join(self.directory, '{}.{}.folded'.format(resource.strip('/').replace('/', '_'), os.getpid()))
+        temporary = '{}.{}.tmp'.format(path, threading.get_ident())
+
+        with open(temporary, 'w') as file:
+            file.writelines(lines)
+        os.replace(temporary, path)
+
+
+profiler = SamplingProfiler()
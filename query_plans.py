@@ -0,0 +1,125 @@
+from datetime import datetime
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from conditional import list_validator_query
+from extensions import db
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+from pagination import REVIEW_SORTS, COMMENT_SORTS, encode_cursor, page_query
+
+
+class Explain(Executable, ClauseElement):
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def compile_explain(element, compiler, **kw):
+    prefix = 'EXPLAIN QUERY PLAN ' if compiler.dialect.name == 'sqlite' else 'EXPLAIN '
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def sample_cursor(sort):
+    key = [datetime.utcnow().isoformat(), 1]
+    if sort == 'rating':
+        key.insert(0, 3)
+    return encode_cursor(key)
+
+
+def page_queries(name, query, model, sorts):
+    for sort in sorts:
+        yield '{} sort={}'.format(name, sort), page_query(query, model, sort=sort)
+        yield '{} sort={} with cursor'.format(name, sort), page_query(query, model, sort=sort, cursor=sample_cursor(sort))
+
+
+def model_queries(user_id, review_id):
+    """(name, query) of every query the model classmethods run while serving requests.
+
+    Built from the same *_query classmethods the models run, so a changed
+    filter is explained as it is served.
+    """
+
+    yield from page_queries('Review.get_published_rows_page', Review.published_rows_query(), Review, REVIEW_SORTS)
+    yield 'list_validator Review.published_query', list_validator_query(Review.published_query())
+
+    for visibility in ('public', 'private', 'all'):
+        yield from page_queries('Review.get_rows_page_by_user {}'.format(visibility),
+                                Review.rows_by_user_query(user_id, visibility), Review, REVIEW_SORTS)
+        yield from page_queries('Comment.get_rows_page_by_user {}'.format(visibility),
+                                Comment.rows_by_user_query(user_id, visibility), Comment, COMMENT_SORTS)
+
+        yield 'list_validator Review.by_user_query {}'.format(visibility), \
+            list_validator_query(Review.by_user_query(user_id, visibility))
+        yield 'list_validator Comment.by_user_query {}'.format(visibility), \
+            list_validator_query(Comment.by_user_query(user_id, visibility))
+
+    yield from page_queries('Comment.get_published_comment_rows_page', Comment.published_comment_rows_query(review_id),
+                            Comment, COMMENT_SORTS)
+    yield 'list_validator Comment.published_comments_query', \
+        list_validator_query(Comment.published_comments_query(review_id))
+
+    if db.engine.name == 'postgresql':
+        yield 'Review.search_page', Review.search_query('review')
+        yield 'Review.search_page with cursor', Review.search_query('review', cursor=encode_cursor([0.1, 1]))
+
+    yield 'Review.get_by_id', Review.by_id_query(review_id).limit(1)
+    yield 'Comment.get_by_id', Comment.by_id_query(1).limit(1)
+    yield 'Review.purge batch', Comment.purge_batch_query(review_id)
+
+    yield 'User.get_by_id', User.by_id_query(user_id).limit(1)
+    yield 'User.get_by_username', User.by_username_query('user').limit(1)
+    yield 'User.get_by_email', User.by_email_query('user@example.com').limit(1)
+    yield 'User.avatar_in_use', User.by_avatar_query('ab/cd/abcd').limit(1)
+
+    if db.engine.name == 'postgresql':
+        # LIKE 'prefix%' only uses an index on postgres, sqlite needs case sensitive like for that
+        yield 'User.search_by_prefix', User.prefix_query('us')
+
+
+def explain(query):
+    """Plan of the query as a list of lines."""
+
+    rows = db.session.execute(Explain(query.statement)).fetchall()
+
+    if db.engine.name == 'sqlite':
+        return [row[-1] for row in rows]    # (id, parent, notused, detail)
+
+    return [row[0] for row in rows]
+
+
+def sequential_scans(plan):
+    if db.engine.name == 'sqlite':
+        # 'SCAN review' reads the whole table, 'SCAN review USING INDEX ...' walks an index in order
+        return [line for line in plan if line.startswith('SCAN ') and 'INDEX' not in line]
+
+    return [line.strip() for line in plan if 'Seq Scan' in line]
+
+
+def check_query_plans():
+    """Explain every model query, returns the (name, plan) of the ones that read a whole table.
+
+    Postgres picks sequential scans for small tables whatever the indexes, so
+    run this against a seeded database.
+    """
+
+    user = db.session.query(User.id).order_by(User.id).first()
+    review = db.session.query(Review.id).order_by(Review.id).first()
+
+    if db.engine.name == 'postgresql':
+        db.session.execute('ANALYZE')
+
+    failures = []
+
+    for name, query in model_queries(user.id if user else 1, review.id if review else 1):
+        plan = explain(query)
+
+        if sequential_scans(plan):
+            failures.append((name, plan))
+
+    db.session.rollback()
+
+    return failures
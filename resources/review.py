@@ -1,8 +1,16 @@
-from flask import request
+from flask import request, current_app
 from flask_restful import Resource
 from flask_jwt_extended import get_jwt_identity, jwt_required, jwt_optional
 from http import HTTPStatus
 
+from webargs.flaskparser import use_kwargs
+
+from conditional import make_etag, last_change, list_validator, validator_headers, not_modified
+from extensions import cache
+from pagination import review_page_args, comment_page_args, search_args
+from search import search_reviews
+from schemas.compiled import CompiledSchema
+
 # review
 from models.review import Review
 from schemas.review import ReviewSchema
@@ -12,23 +20,51 @@ from models.comment import Comment
 from schemas.comment import CommentSchema
 
 review_schema = ReviewSchema()
-review_list_schema = ReviewSchema(many=True)
+review_list_schema = CompiledSchema(ReviewSchema(many=True))
 
 comment_schema = CommentSchema()
-comment_list_schema = CommentSchema(many=True)
+comment_list_schema = CompiledSchema(CommentSchema(many=True))
 
 
 # Create a review or list all reviews
 class ReviewListResource(Resource):
 
-    def get(self):
+    @use_kwargs(review_page_args)
+    def get(self, limit, cursor, sort):
+
+        # never cached, a worker the invalidation did not reach would answer 304 for a changed list
+        cache.read_fresh('reviews')
+        count, last_modified = list_validator(Review.published_query())
+        etag = make_etag('reviews', sort, limit, cursor, count, last_modified)
 
-        reviews = Review.get_all_published()
+        response = not_modified(etag)
+        if response:
+            return response     # client copy is current, nothing is loaded or serialized
 
-        if reviews is None or reviews == []:
+        try:
+            # keyed by the validator as well, so the page always matches the ETag sent with it
+            data = cache.get_or_set(cache.key('reviews', sort, limit, cursor, count, last_modified),
+                                    lambda: self.load_page(sort=sort, limit=limit, cursor=cursor))
+        except ValueError:
+            return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+
+        if data is None:
             return {'message': 'There are no reviews.'}, HTTPStatus.NOT_FOUND
 
-        return review_list_schema.dump(reviews).data, HTTPStatus.OK     # returns reviews
+        return data, HTTPStatus.OK, validator_headers(etag)     # returns reviews
+
+    @staticmethod
+    def load_page(sort, limit, cursor):
+
+        reviews, next_cursor = Review.get_published_rows_page(sort=sort, limit=limit, cursor=cursor)
+
+        if not reviews and cursor is None:
+            return None
+
+        data = review_list_schema.dump(reviews)
+        data['next_cursor'] = next_cursor
+
+        return data
 
     @jwt_required
     def post(self):
@@ -47,17 +83,63 @@ class ReviewListResource(Resource):
         return review_schema.dump(review).data, HTTPStatus.CREATED
 
 
+# Search published reviews by title and content
+class ReviewSearchResource(Resource):
+
+    @use_kwargs(search_args)
+    def get(self, q, limit, cursor):
+
+        try:
+            reviews, next_cursor = search_reviews(q, limit=limit, cursor=cursor)
+        except ValueError:
+            return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+
+        data = review_list_schema.dump(reviews)     # best matches first
+        data['next_cursor'] = next_cursor
+
+        return data, HTTPStatus.OK
+
+
 # Create a comment for a review, or Get list of all published comments of a review
 class ReviewCommentListResource(Resource):
 
-    def get(self, review_id):
+    @use_kwargs(comment_page_args)
+    def get(self, review_id, limit, cursor, sort):
+
+        namespace = 'comments:{}'.format(review_id)
+
+        cache.read_fresh(namespace)
+        count, last_modified = list_validator(Comment.published_comments_query(review_id))
+        etag = make_etag(namespace, sort, limit, cursor, count, last_modified)
 
-        comments = Comment.get_all_published_comments(review_id=review_id)
+        response = not_modified(etag)
+        if response:
+            return response
 
-        if comments is None or comments == []:
+        try:
+            data = cache.get_or_set(cache.key(namespace, sort, limit, cursor, count, last_modified),
+                                    lambda: self.load_page(review_id=review_id, sort=sort, limit=limit, cursor=cursor))
+        except ValueError:
+            return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+
+        if data is None:
             return {'message': 'The review has no comments.'}, HTTPStatus.NOT_FOUND
 
-        return comment_list_schema.dump(comments).data, HTTPStatus.OK
+        return data, HTTPStatus.OK, validator_headers(etag)
+
+    @staticmethod
+    def load_page(review_id, sort, limit, cursor):
+
+        comments, next_cursor = Comment.get_published_comment_rows_page(review_id=review_id, sort=sort,
+                                                                         limit=limit, cursor=cursor)
+
+        if not comments and cursor is None:
+            return None
+
+        data = comment_list_schema.dump(comments)
+        data['next_cursor'] = next_cursor
+
+        return data
 
     @jwt_required
     def post(self, review_id):
@@ -83,17 +165,38 @@ class ReviewResource(Resource):
     @jwt_optional
     def get(self, review_id):
 
-        review = Review.get_by_id(review_id=review_id)  # finds review
+        entry = cache.get_or_set(cache.key('review:{}'.format(review_id)), lambda: self.load(review_id))
 
-        if review is None:
+        if entry is None:
             return {'message': 'Review not found'}, HTTPStatus.NOT_FOUND
 
         current_user = get_jwt_identity()
 
-        if review.is_publish == False and review.user_id != current_user:
+        if entry['is_publish'] == False and entry['user_id'] != current_user:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
-        return review_schema.dump(review).data, HTTPStatus.OK
+        etag = make_etag('review', review_id, entry['updated_at'])
+
+        response = not_modified(etag, entry['updated_at'])
+        if response:
+            return response
+
+        return entry['data'], HTTPStatus.OK, validator_headers(etag, entry['updated_at'])
+
+    @staticmethod
+    def load(review_id):
+
+        review = Review.get_by_id(review_id=review_id)  # finds review
+
+        if review is None:
+            return None
+
+        # keep owner, publish state and last change next to the data so access and
+        # validators can be checked on a cache hit
+        return {'is_publish': review.is_publish,
+                'user_id': review.user_id,
+                'updated_at': last_change(review.updated_at, review.user.updated_at if review.user else None),
+                'data': review_schema.dump(review).data}
 
     @jwt_required
     def patch(self, review_id):
@@ -121,13 +224,15 @@ class ReviewResource(Resource):
 
         review.save()
 
+        cache.invalidate('review:{}'.format(review_id), 'reviews')
+
         return review_schema.dump(review).data, HTTPStatus.OK
 
     @jwt_required
     def delete(self, review_id):
 
         review = Review.get_by_id(review_id=review_id)
-        comments = Comment.get_all_published_comments(review_id=review_id)
+
         if review is None:
             return {'message': 'Review not found'}, HTTPStatus.NOT_FOUND
 
@@ -136,12 +241,13 @@ class ReviewResource(Resource):
         if current_user != review.user_id:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
-        # for every comment in review
-        # delete comment
-        for comment in comments:
-            comment.delete()
+        if current_app.config.get('REVIEW_DELETE_MODE') == 'deferred':
+            review.mark_deleted()
+            Review.purge_in_background(review_id)   # comments are removed in batches after the response
+        else:
+            review.delete()     # review and all of its comments in one transaction
 
-        review.delete()
+        cache.invalidate('review:{}'.format(review_id), 'reviews', 'comments:{}'.format(review_id))
 
         return {}, HTTPStatus.NO_CONTENT
 
@@ -166,7 +272,14 @@ class ReviewCommentResource(Resource):
         if comment.is_publish == False and comment.user_id != current_user:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
-        return comment_schema.dump(comment).data, HTTPStatus.OK
+        last_modified = last_change(comment.updated_at, comment.user.updated_at if comment.user else None)
+        etag = make_etag('comment', comment_id, last_modified)
+
+        response = not_modified(etag, last_modified)
+        if response:
+            return response
+
+        return comment_schema.dump(comment).data, HTTPStatus.OK, validator_headers(etag, last_modified)
 
     @jwt_required
     def patch(self, review_id, comment_id):    # review id parameter to avoid TypeError
@@ -197,6 +310,8 @@ class ReviewCommentResource(Resource):
 
         comment.save()
 
+        cache.invalidate('comments:{}'.format(comment.review_id))
+
         return comment_schema.dump(comment).data, HTTPStatus.OK
 
     @jwt_required
@@ -216,7 +331,11 @@ class ReviewCommentResource(Resource):
         if current_user != comment.user_id:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
+        comment_review_id = comment.review_id
         comment.delete()
+
+        cache.invalidate('review:{}'.format(comment_review_id), 'reviews', 'comments:{}'.format(comment_review_id))
+
         return {}, HTTPStatus.NO_CONTENT
 
 
@@ -239,6 +358,8 @@ class ReviewPublishResource(Resource):
         review.is_publish = True
         review.save()
 
+        cache.invalidate('review:{}'.format(review_id), 'reviews')
+
         return {}, HTTPStatus.NO_CONTENT
 
     @jwt_required
@@ -256,6 +377,8 @@ class ReviewPublishResource(Resource):
         review.is_publish = False
         review.save()
 
+        cache.invalidate('review:{}'.format(review_id), 'reviews')
+
         return {}, HTTPStatus.NO_CONTENT
 
 
@@ -279,13 +402,10 @@ class ReviewCommentPublishResource(Resource):
         if current_user != comment.user_id:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
-        comment.is_publish = True
-        comment.save()
+        comment_review_id = comment.review_id
+        comment.publish()   # updates the comment counter of the review in the same transaction
 
-        # update review comments after new comment was published
-        comments = Comment.get_all_published_comments(review_id=review_id) # get comments of review
-        review.comments = len(comments)   # count length of list get number of comments
-        review.save()    # update review with correct comment amount
+        cache.invalidate('review:{}'.format(comment_review_id), 'reviews', 'comments:{}'.format(comment_review_id))
 
         return {}, HTTPStatus.NO_CONTENT
 
@@ -305,13 +425,10 @@ class ReviewCommentPublishResource(Resource):
         if current_user != comment.user_id:
             return {'message': 'Access is not allowed'}, HTTPStatus.FORBIDDEN
 
-        comment.is_publish = False
-        comment.save()
+        comment_review_id = comment.review_id
+        comment.unpublish()   # updates the comment counter of the review in the same transaction
 
-        # update review comments after new comment was published
-        comments = Comment.get_all_published_comments(review_id=review_id) # get comments of review
-        review.comments = len(comments)   # count length of list get number of comments
-        review.save()    # update review with correct comment amount
+        cache.invalidate('review:{}'.format(comment_review_id), 'reviews', 'comments:{}'.format(comment_review_id))
 
         return {}, HTTPStatus.NO_CONTENT
 
@@ -10,14 +10,15 @@ from flask_jwt_extended import (
     get_raw_jwt
 )
 
-from utils import check_password
+from utils import check_password, hash_password, password_needs_rehash
+from extensions import limiter
 from models.user import User
-
-black_list = set()
+from revocation import revoked_tokens
 
 
 class TokenResource(Resource):
 
+    @limiter.limit('token')
     def post(self):
 
         json_data = request.get_json()
@@ -33,6 +34,11 @@ class TokenResource(Resource):
         if user.is_active is False:
             return {'message': 'The user account is not activated yet'}, HTTPStatus.FORBIDDEN
 
+        # work factor changed since the password was stored, upgrade it while the plain password is at hand
+        if password_needs_rehash(user.password):
+            user.password = hash_password(password)
+            user.save()
+
         access_token = create_access_token(identity=user.id, fresh=True)
         refresh_token = create_refresh_token(identity=user.id)
 
@@ -54,8 +60,8 @@ class RevokeResource(Resource):
 
     @jwt_required
     def post(self):
-        jti = get_raw_jwt()['jti']
+        raw_jwt = get_raw_jwt()
 
-        black_list.add(jti)
+        revoked_tokens.revoke(raw_jwt['jti'], raw_jwt['exp'])
 
         return {'message': 'Successfully logged out'}, HTTPStatus.OK
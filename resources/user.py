@@ -1,6 +1,7 @@
 import os
+from functools import partial
 
-from flask import request, url_for, render_template
+from flask import current_app, request, url_for, render_template
 from flask_restful import Resource
 from flask_jwt_extended import jwt_optional, get_jwt_identity, jwt_required
 from http import HTTPStatus
@@ -8,8 +9,9 @@ from http import HTTPStatus
 from webargs import fields
 from webargs.flaskparser import use_kwargs
 
-from extensions import image_set
-from mailgun import MailgunApi
+from conditional import make_etag, list_validator, validator_headers, not_modified
+from extensions import image_set, cache, mail_queue, limiter
+from models.avatar_job import AvatarJob
 from models.review import Review
 from models.comment import Comment
 
@@ -18,23 +20,26 @@ from models.user import User
 from schemas.user import UserSchema
 from schemas.review import ReviewSchema
 from schemas.comment import CommentSchema
+from schemas.compiled import CompiledSchema
 
+from pagination import review_page_args, comment_page_args, username_search_args
+from search import username_prefixes
 
-from utils import generate_token, verify_token, save_image
+from avatar_jobs import avatar_processor
+from unit_of_work import unit_of_work
+from utils import generate_token, verify_token, save_upload, hash_password
 
 
 user_schema = UserSchema()
 user_public_schema = UserSchema(exclude=('email', ))
-user_avatar_schema = UserSchema(only=('avatar_url', ))
-review_list_schema = ReviewSchema(many=True)
-comment_list_schema = CommentSchema(many=True)
-
-
-mailgun = MailgunApi(domain=os.environ.get('MAILGUN_DOMAIN'),
-                     api_key=os.environ.get('MAILGUN_API_KEY'))
+user_suggestion_schema = CompiledSchema(UserSchema(only=('id', 'username', 'avatar_url'), many=True))
+review_list_schema = CompiledSchema(ReviewSchema(many=True))
+comment_list_schema = CompiledSchema(CommentSchema(many=True))
 
 
 class UserListResource(Resource):
+
+    @limiter.limit('users')
     def post(self):
 
         json_data = request.get_json()
@@ -50,6 +55,9 @@ class UserListResource(Resource):
         if User.get_by_email(data.get('email')):
             return {'message': 'email already used'}, HTTPStatus.BAD_REQUEST
 
+        # hashed only now, invalid or duplicate registrations never pay for the key derivation
+        data['password'] = hash_password(data['password'])
+
         user = User(**data)
         user.save()
 
@@ -63,32 +71,60 @@ class UserListResource(Resource):
 
         text = 'Welcome to General Review Blog! Please use this link to confirm your registration: {}'.format(link)
 
-        mailgun.send_email(to=user.email,
-                           subject=subject,
-                           text=text,
-                           html=render_template('email/confirmation.html', link=link))
+        # only enqueued here, a worker thread talks to mailgun, once the user is committed
+        unit_of_work.after_commit(partial(mail_queue.send_email,
+                                          to=user.email,
+                                          subject=subject,
+                                          text=text,
+                                          html=render_template('email/confirmation.html', link=link)))
 
         return user_schema.dump(user).data, HTTPStatus.CREATED
 
 
+class UserSearchResource(Resource):
+
+    @use_kwargs(username_search_args)
+    def get(self, prefix, limit):
+
+        users = username_prefixes.search(prefix, limit=limit)
+
+        return {'data': user_suggestion_schema.dump(users)}, HTTPStatus.OK
+
+
 class UserResource(Resource):
 
     @jwt_optional
     def get(self, username):
 
-        user = User.get_by_username(username=username)
+        entry = cache.get_or_set(cache.key('user:{}'.format(username)), lambda: self.load(username))
 
-        if user is None:
+        if entry is None:
             return {'message': 'User not found'}, HTTPStatus.NOT_FOUND
 
         current_user = get_jwt_identity()
 
-        if current_user == user.id:
-            data = user_schema.dump(user).data
-        else:
-            data = user_public_schema.dump(user).data
+        variant = 'private' if current_user == entry['id'] else 'public'
+        etag = make_etag('user', entry['id'], variant, entry['updated_at'])
 
-        return data, HTTPStatus.OK
+        # owners get their email as well
+        response = not_modified(etag, entry['updated_at'], vary='Authorization')
+        if response:
+            return response
+
+        return entry[variant], HTTPStatus.OK, validator_headers(etag, entry['updated_at'], vary='Authorization')
+
+    @staticmethod
+    def load(username):
+
+        user = User.get_by_username(username=username)
+
+        if user is None:
+            return None
+
+        return {'id': user.id,
+                'updated_at': user.updated_at,
+                'private': user_schema.dump(user).data,
+                'public': user_public_schema.dump(user).data}
 
 
 class MeResource(Resource):
@@ -103,8 +139,8 @@ class MeResource(Resource):
 class UserReviewListResource(Resource):
 
     @jwt_optional
-    @use_kwargs({'visibility': fields.Str(missing='public')})
-    def get(self, username, visibility):
+    @use_kwargs(dict(review_page_args, visibility=fields.Str(missing='public')))
+    def get(self, username, visibility, limit, cursor, sort):
 
         user = User.get_by_username(username=username)
 
@@ -118,16 +154,31 @@ class UserReviewListResource(Resource):
         else:
             visibility = 'public'
 
-        reviews = Review.get_all_by_user(user_id=user.id, visibility=visibility)
+        count, last_modified = list_validator(Review.by_user_query(user.id, visibility))
+        etag = make_etag('reviews', user.id, visibility, sort, limit, cursor, count, last_modified)
+
+        # owners may see their unpublished reviews
+        response = not_modified(etag, vary='Authorization')
+        if response:
+            return response
+
+        try:
+            reviews, next_cursor = Review.get_rows_page_by_user(user_id=user.id, visibility=visibility,
+                                                                sort=sort, limit=limit, cursor=cursor)
+        except ValueError:
+            return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
 
-        return review_list_schema.dump(reviews).data, HTTPStatus.OK
+        data = review_list_schema.dump(reviews)
+        data['next_cursor'] = next_cursor
+
+        return data, HTTPStatus.OK, validator_headers(etag, vary='Authorization')
 
 
 class UserCommentListResource(Resource):
 
     @jwt_optional
-    @use_kwargs({'visibility': fields.Str(missing='public')})
-    def get(self, username, visibility):
+    @use_kwargs(dict(comment_page_args, visibility=fields.Str(missing='public')))
+    def get(self, username, visibility, limit, cursor, sort):
 
         user = User.get_by_username(username=username)
 
@@ -141,9 +192,24 @@ class UserCommentListResource(Resource):
         else:
             visibility = 'public'
 
-        comments = Comment.get_all_by_user(user_id=user.id, visibility=visibility)
+        count, last_modified = list_validator(Comment.by_user_query(user.id, visibility))
+        etag = make_etag('comments', user.id, visibility, sort, limit, cursor, count, last_modified)
+
+        # owners may see their unpublished comments
+        response = not_modified(etag, vary='Authorization')
+        if response:
+            return response
 
-        return comment_list_schema.dump(comments).data, HTTPStatus.OK
+        try:
+            comments, next_cursor = Comment.get_rows_page_by_user(user_id=user.id, visibility=visibility,
+                                                                  sort=sort, limit=limit, cursor=cursor)
+        except ValueError:
+            return {'message': 'Invalid cursor'}, HTTPStatus.BAD_REQUEST
+
+        data = comment_list_schema.dump(comments)
+        data['next_cursor'] = next_cursor
+
+        return data, HTTPStatus.OK, validator_headers(etag, vary='Authorization')
 
 
 class UserActivateResource(Resource):
@@ -167,12 +233,15 @@ class UserActivateResource(Resource):
 
         user.save()
 
+        unit_of_work.after_commit(username_prefixes.clear)    # activated users start showing up in autocomplete
+
         return {}, HTTPStatus.NO_CONTENT
 
 
 class UserAvatarUploadResource(Resource):
 
     @jwt_required
+    @limiter.limit('avatar')
     def put(self):
 
         file = request.files.get('avatar')
@@ -183,16 +252,38 @@ class UserAvatarUploadResource(Resource):
         if not image_set.file_allowed(file, file.filename):
             return {'message': 'File type not allowed'}, HTTPStatus.BAD_REQUEST
 
-        user = User.get_by_id(id=get_jwt_identity())
+        source_path = save_upload(image=file, directory=current_app.config['UPLOAD_SPOOL_DIR'])
+        destination = os.path.join(image_set.config.destination, 'avatars')
 
-        if user.avatar_image:
-            avatar_path = image_set.path(folder='avatars', filename=user.avatar_image)
-            if os.path.exists(avatar_path):
-                os.remove(avatar_path)
+        # resizing happens in the image process pool, the client polls the job for the result
+        job_id = avatar_processor.submit(user_id=get_jwt_identity(), source_path=source_path, destination=destination)
 
-        filename = save_image(image=file, folder='avatars')
+        if job_id is None:
+            os.remove(source_path)
+            return {'message': 'Too many images are being processed, try again later'}, HTTPStatus.SERVICE_UNAVAILABLE
 
-        user.avatar_image = filename
-        user.save()
+        return {'job_id': job_id,
+                'status': 'pending',
+                'status_url': url_for('useravatarjobresource', job_id=job_id, _external=True)}, HTTPStatus.ACCEPTED
 
-        return user_avatar_schema.dump(user).data, HTTPStatus.OK
+
+class UserAvatarJobResource(Resource):
+
+    @jwt_required
+    def get(self, job_id):
+
+        job = AvatarJob.get_by_id(job_id)
+
+        if job is None or job.user_id != get_jwt_identity():
+            return {'message': 'Job not found'}, HTTPStatus.NOT_FOUND
+
+        data = {'job_id': job_id, 'status': job.status}
+
+        if job.status == 'done':
+            data['avatar_urls'] = {
+                size: {ext: url_for('static', filename='images/avatars/{}'.format(filename), _external=True)
+                       for ext, filename in formats.items()}
+                for size, formats in job.variants.items()
+            }
+
+        return data, HTTPStatus.OK
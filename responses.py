@@ -0,0 +1,92 @@
+import gzip
+import hashlib
+import json
+import time
+import zlib
+from datetime import date, datetime
+
+from flask import make_response, request
+
+from cache import LRUCache
+from instrumentation import request_timer
+
+try:
+    import orjson
+except ImportError:     # optional, falls back to the standard library
+    orjson = None
+
+
+def default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=default)
+    return json.dumps(data, default=default, separators=(',', ':')).encode()
+
+
+def output_json(data, code, headers=None):
+    start = time.perf_counter()
+    body = dumps(data)
+    request_timer.add_serialize(time.perf_counter() - start)
+
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
+
+
+class Compressor:
+    """gzip/deflate for JSON responses above a minimum size.
+
+    Compressed bodies are kept in an LRU keyed by a digest of the plain body,
+    so hot payloads (mostly served from the response cache) are compressed once.
+    """
+
+    def __init__(self):
+        self.min_size = 1024
+        self.level = 6
+        self.bodies = LRUCache(maxsize=256, ttl=300)
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        self.bodies = LRUCache(maxsize=app.config.get('COMPRESS_CACHE_SIZE', 256), ttl=300)
+
+        app.after_request(self.compress_response)
+
+    def compress(self, body, encoding):
+        if encoding == 'gzip':
+            return gzip.compress(body, compresslevel=self.level, mtime=0)
+        return zlib.compress(body, self.level)
+
+    def compress_response(self, response):
+        if response.mimetype != 'application/json' or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers or response.status_code < 200 or response.status_code >= 300:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+        body = response.get_data()
+
+        if encoding is None or len(body) < self.min_size:
+            return response
+
+        key = (encoding, hashlib.blake2b(body, digest_size=16).digest())
+        compressed = self.bodies.get(key)
+
+        if compressed is None:
+            compressed = self.compress(body, encoding)
+            self.bodies.set(key, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+
+        return response
+
+
+compressor = Compressor()
@@ -0,0 +1,136 @@
+import hashlib
+import threading
+import time
+from datetime import datetime
+
+from models.revoked_token import RevokedToken
+
+
+class BloomFilter:
+
+    def __init__(self, capacity=10000, hashes=7):
+        self.size = max(capacity, 1) * 10     # ~1% false positives at capacity
+        self.hashes = hashes
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], 'little')
+        b = int.from_bytes(digest[8:], 'little') | 1
+        return [(a + i * b) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self.positions(value))
+
+
+class DatabaseStore:
+    """Revoked tokens in the revoked_token table, shared by every worker."""
+
+    def add(self, jti, expires_at):
+        RevokedToken(jti=jti, expires_at=expires_at).save()
+
+    def contains(self, jti):
+        return RevokedToken.is_revoked(jti)
+
+    def active_jtis(self):
+        # read only, expired rows are removed by flask purge-revoked-tokens
+        return RevokedToken.get_all_active_jtis()
+
+
+class LocalStore:
+    """In-process key-value stand-in for DatabaseStore, for a single worker or tests."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, jti, expires_at):
+        with self.lock:
+            self.entries[jti] = expires_at
+
+    def contains(self, jti):
+        expires_at = self.entries.get(jti)
+        return expires_at is not None and expires_at > datetime.utcnow()
+
+    def active_jtis(self):
+        now = datetime.utcnow()
+        with self.lock:
+            self.entries = {jti: expires_at for jti, expires_at in self.entries.items() if expires_at > now}
+            return list(self.entries)
+
+
+class RevocationList:
+    """Revoked token ids, kept until the token itself expires.
+
+    A bloom filter of the revoked ids answers most "not revoked" checks without
+    asking the store. It is rebuilt from the store every REVOCATION_REFRESH
+    seconds, so a revoke made by another worker applies there within that time.
+    Revokes of this worker go into every rebuilt filter until the store
+    returns them, a rebuild racing the commit of a revoke does not lose it.
+    """
+
+    def __init__(self):
+        self.store = LocalStore()
+        self.refresh_interval = 5
+        self.bloom = None
+        self.next_refresh = 0
+        self.pending = {}   # jti: expires_at of local revokes the store did not return yet
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config.get('REVOCATION_BACKEND', 'database') == 'database':
+            self.store = DatabaseStore()
+        else:
+            self.store = LocalStore()
+
+        self.refresh_interval = app.config.get('REVOCATION_REFRESH', 5)
+        self.bloom = None
+        self.pending = {}
+
+    def revoke(self, jti, exp):
+        expires_at = datetime.utcfromtimestamp(exp)
+        self.store.add(jti, expires_at)
+
+        with self.lock:
+            self.pending[jti] = expires_at
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def is_revoked(self, jti):
+        bloom = self.bloom
+        if bloom is None or time.monotonic() >= self.next_refresh:
+            bloom = self.refresh()
+
+        if jti not in bloom:
+            return False
+
+        return self.store.contains(jti)
+
+    def refresh(self):
+        with self.lock:
+            # another thread may have rebuilt the filter while this one waited for the lock
+            if self.bloom is not None and time.monotonic() < self.next_refresh:
+                return self.bloom
+
+            jtis = set(self.store.active_jtis())
+
+            # the store may not see a revoke whose transaction is still open
+            now = datetime.utcnow()
+            self.pending = {jti: expires_at for jti, expires_at in self.pending.items()
+                            if jti not in jtis and expires_at > now}
+
+            bloom = BloomFilter(capacity=max((len(jtis) + len(self.pending)) * 2, 10000))
+            for jti in jtis | set(self.pending):
+                bloom.add(jti)
+
+            self.bloom = bloom
+            self.next_refresh = time.monotonic() + self.refresh_interval
+
+            return bloom
+
+
+revoked_tokens = RevocationList()
@@ -0,0 +1,154 @@
+import logging
+import random
+import time
+
+from flask import g, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, exc, orm
+from sqlalchemy.sql import Select
+
+from cache import LRUCache, RedisCache
+from metrics import watch_pool
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def engine_options(uri, config):
+    options = {'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+               'pool_recycle': config.get('DB_POOL_RECYCLE', 1800)}
+
+    # sqlite connects per checkout instead of keeping a sized pool
+    if not uri.startswith('sqlite'):
+        options.update(pool_size=config.get('DB_POOL_SIZE', 10),
+                       max_overflow=config.get('DB_MAX_OVERFLOW', 20),
+                       pool_timeout=config.get('DB_POOL_TIMEOUT', 30))
+
+    return options
+
+
+class ReplicaRouter:
+    """Sends the SELECTs of GET requests to read replicas, writes always go to the primary.
+
+    A user who wrote something keeps reading from the primary for
+    REPLICA_STICKY_SECONDS, long enough for the replicas to catch up, so they
+    always see their own writes. Requests filling the cache of a namespace
+    invalidated as recently read from the primary as well (read_primary), so
+    no one caches what a replica had before the write. A replica that can not be connected to is
+    skipped for REPLICA_RETRY_INTERVAL seconds and its reads go to the
+    primary meanwhile. Without SQLALCHEMY_REPLICA_URIS everything uses the
+    primary.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.down_until = {}
+        self.retry_interval = 30
+        self.writes = LRUCache()
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                              engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config))
+
+        self.replicas = [create_engine(uri, **engine_options(uri, app.config))
+                         for uri in app.config.get('SQLALCHEMY_REPLICA_URIS', [])]
+        self.down_until = {}
+        self.retry_interval = app.config.get('REPLICA_RETRY_INTERVAL', 30)
+
+        for number, engine in enumerate(self.replicas):
+            watch_pool(engine.pool, name='replica{}'.format(number))
+
+        # shared by the workers when redis is there, a user may hit any of them next
+        sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 5)
+        if app.config.get('CACHE_REDIS_URL'):
+            self.writes = RedisCache(app.config['CACHE_REDIS_URL'], ttl=sticky_seconds, prefix='review-blog:writes:')
+        else:
+            self.writes = LRUCache(maxsize=10000, ttl=sticky_seconds)
+
+        app.after_request(self.remember_write)
+
+    def remember_write(self, response):
+        if self.replicas and request.method not in READ_METHODS and response.status_code < 400:
+            identity = get_jwt_identity()
+            if identity is not None:
+                self.writes.set(str(identity), True)
+
+        return response
+
+    def sticky(self):
+        """True while the current user's own recent write may not have reached the replicas."""
+
+        if not self.replicas or not has_request_context():
+            return False
+
+        identity = get_jwt_identity()
+        if identity is None:
+            return False
+
+        cached = g.get('sticky')
+        if cached is None or cached[0] != identity:
+            cached = g.sticky = (identity, self.writes.get(str(identity)) is not None)
+
+        return cached[1]
+
+    def read_primary(self):
+        """Sends the remaining reads of the current request to the primary."""
+
+        if has_request_context():
+            g.read_primary = True
+
+    def reads_from_replica(self):
+        return bool(self.replicas) and has_request_context() and request.method in READ_METHODS \
+            and not g.get('read_primary') and not self.sticky()
+
+    def replica(self, session):
+        """Replica engine for the session, None when every replica is down."""
+
+        engine = g.get('replica')
+        if engine is not None:
+            return engine
+
+        now = time.monotonic()
+        candidates = [engine for engine in self.replicas if self.down_until.get(engine, 0) <= now]
+        random.shuffle(candidates)
+
+        for engine in candidates:
+            try:
+                # checked out now instead of by the query, so a dead replica falls back to the primary
+                session.connection(bind=engine)
+            except exc.DBAPIError:
+                logger.warning('Replica %s is unavailable, reading from the primary', engine.url)
+                self.down_until[engine] = now + self.retry_interval
+                continue
+
+            g.replica = engine
+            return engine
+
+        return None
+
+
+replica_router = ReplicaRouter()
+
+
+def is_read(clause):
+    # queries pass their select, bulk update()/delete() their dml statement and flushes none at all
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and is_read(clause) and replica_router.reads_from_replica():
+            engine = replica_router.replica(self)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
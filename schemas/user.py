@@ -1,7 +1,7 @@
-from flask import url_for
-from marshmallow import Schema, fields
+from functools import lru_cache
 
-from utils import hash_password
+from flask import url_for, request
+from marshmallow import Schema, fields
 
 
 class UserSchema(Schema):
@@ -11,20 +11,25 @@ class UserSchema(Schema):
     id = fields.Int(dump_only=True)
     username = fields.String(required=True)
     email = fields.Email(required=True)
-    password = fields.Method(required=True, deserialize='load_password')
+    password = fields.String(required=True, load_only=True)   # hashed by the resource after validation
     avatar_url = fields.Method(serialize='dump_avatar_url')
 
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
 
-    def load_password(self, value):
-        return hash_password(value)
-
     def dump_avatar_url(self, user):
+        prefix = images_url(request.host_url)
+
         if user.avatar_image:
-            return url_for('static', filename='images/avatars/{}'.format(user.avatar_image), _external=True)
+            return prefix + 'avatars/' + user.avatar_image
         else:
-            return url_for('static', filename='images/assets/default-avatar.jpg', _external=True)
+            return prefix + 'assets/default-avatar.jpg'
+
+
+@lru_cache(maxsize=32)
+def images_url(host_url):
+    # built once per host instead of a url_for call for every dumped user
+    return url_for('static', filename='images/', _external=True)
 
 
 
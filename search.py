@@ -0,0 +1,192 @@
+import bisect
+import math
+import re
+import threading
+from collections import defaultdict, Counter
+
+from sqlalchemy import event
+
+from cache import LRUCache
+from extensions import db
+from models.review import Review
+from models.user import User
+from pagination import encode_cursor, decode_rank_cursor
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+TITLE_WEIGHT = 2
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall((text or '').lower())
+
+
+class InvertedIndex:
+    """In-process full text index of published reviews.
+
+    Stand-in for the postgres tsvector index on databases without full text
+    search (sqlite in tests). Built from the database on the first search and
+    kept current by mapper events afterwards.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)    # term -> {review id: term frequency}
+        self.documents = {}     # review id -> terms
+        self.built = False
+        self.lock = threading.RLock()
+
+    def clear(self):
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            self.built = False
+
+    def build(self):
+        with self.lock:
+            if self.built:
+                return
+
+            query = db.session.query(Review.id, Review.title, Review.content).filter_by(is_publish=True)
+            for review_id, title, content in query:
+                self.add(review_id, title, content)
+
+            self.built = True
+
+    def add(self, review_id, title, content):
+        with self.lock:
+            self.remove(review_id)
+
+            terms = Counter(tokenize(content))
+            for term in tokenize(title):
+                terms[term] += TITLE_WEIGHT
+
+            for term, frequency in terms.items():
+                self.postings[term][review_id] = frequency
+
+            self.documents[review_id] = list(terms)
+
+    def remove(self, review_id):
+        with self.lock:
+            for term in self.documents.pop(review_id, []):
+                self.postings[term].pop(review_id, None)
+                if not self.postings[term]:
+                    del self.postings[term]
+
+    def search(self, q):
+        """Ranked (score, review id) pairs of reviews containing every term of the query."""
+
+        terms = set(tokenize(q))
+
+        with self.lock:
+            if not terms or any(term not in self.postings for term in terms):
+                return []
+
+            matches = set.intersection(*(set(self.postings[term]) for term in terms))
+            total = len(self.documents)
+
+            scores = []
+            for review_id in matches:
+                score = 0.0
+                for term in terms:
+                    idf = math.log(1 + total / len(self.postings[term]))
+                    score += (1 + math.log(self.postings[term][review_id])) * idf
+                scores.append((round(score, 6), review_id))
+
+        return sorted(scores, reverse=True)
+
+
+review_index = InvertedIndex()
+
+
+def search_reviews(q, limit=20, cursor=None):
+
+    if db.engine.name == 'postgresql':
+        return Review.search_page(q, limit=limit, cursor=cursor)
+
+    review_index.build()
+    ranked = review_index.search(q)
+
+    if cursor:
+        last = decode_rank_cursor(cursor)
+        ranked = [key for key in ranked if (key[0], key[1]) < (last[0], last[1])]
+
+    page = ranked[:limit]
+    next_cursor = encode_cursor(list(page[-1])) if len(ranked) > limit else None
+
+    reviews = {review.id: review for review in Review.with_author().filter(Review.id.in_([key[1] for key in page]))}
+
+    return [reviews[review_id] for _, review_id in page if review_id in reviews], next_cursor
+
+
+@event.listens_for(Review, 'after_insert')
+@event.listens_for(Review, 'after_update')
+def index_review(mapper, connection, target):
+    if not review_index.built:
+        return
+
+    if target.is_publish and not target.is_deleted:
+        review_index.add(target.id, target.title, target.content)
+    else:
+        review_index.remove(target.id)
+
+
+@event.listens_for(Review, 'after_delete')
+def unindex_review(mapper, connection, target):
+    review_index.remove(target.id)
+
+
+class PrefixCache:
+    """Username autocomplete results of the hottest prefixes, kept in this process.
+
+    Every entry holds the matching users sorted by username. An entry with
+    fewer users than the limit holds every match of its prefix, so longer
+    prefixes typed after it are answered from it with a bisect instead of a
+    query.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30):
+        self.entries = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def lookup(self, prefix, limit):
+        for length in range(len(prefix), 0, -1):
+            entry = self.entries.get((prefix[:length], limit))
+
+            if entry is None:
+                continue
+
+            if length < len(prefix) and len(entry) >= limit:
+                return None     # incomplete for the longer prefix
+
+            usernames = [row.username for row in entry]
+            start = bisect.bisect_left(usernames, prefix)
+            end = start
+            while end < len(entry) and usernames[end].startswith(prefix):
+                end += 1
+
+            return entry[start:end]
+
+        return None
+
+    def search(self, prefix, limit):
+        rows = self.lookup(prefix, limit)
+
+        if rows is None:
+            # sorted here as well, the database collation may order differently than bisect expects
+            rows = sorted(User.search_by_prefix(prefix, limit=limit), key=lambda row: row.username)
+            self.entries.set((prefix, limit), rows)
+
+        return rows
+
+    def invalidate(self, username):
+        # only entries of prefixes of the username can hold the user, compared case
+        # insensitively as the database may match them that way
+        username = username.lower()
+
+        for key in self.entries.keys():
+            if username.startswith(key[0].lower()):
+                self.entries.delete(key)
+
+    def clear(self):
+        self.entries.clear()
+
+
+username_prefixes = PrefixCache()
@@ -0,0 +1,101 @@
+import random
+from datetime import datetime, timedelta
+
+from extensions import db
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+from utils import hash_password
+
+SEED_PASSWORD = 'password'      # every seeded user logs in with user<n>@example.com and this password
+SEED_EPOCH = datetime(2020, 1, 1)   # users are created then, reviews and comments in the year after
+
+WORDS = ('good', 'bad', 'great', 'coffee', 'movie', 'book', 'phone', 'camera', 'album', 'game', 'price',
+         'quality', 'battery', 'story', 'sound', 'taste', 'service', 'design', 'value', 'recommend')
+
+
+def sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize()
+
+
+def insert(table, rows, batch_size):
+    # one executemany per batch instead of one insert and flush per object
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start:start + batch_size])
+        db.session.commit()
+
+
+def new_ids(model, after):
+    return [row.id for row in db.session.query(model.id).filter(model.id > after).order_by(model.id)]
+
+
+def last_id(model):
+    return db.session.query(db.func.coalesce(db.func.max(model.id), 0)).scalar()
+
+
+def batches(count, batch_size):
+    for start in range(0, count, batch_size):
+        yield start, min(batch_size, count - start)
+
+
+def seed(users=100, reviews=1000, comments=10000, batch_size=1000, random_seed=0, publish_ratio=0.8):
+    """Bulk insert users, reviews and comments, returns the number of rows of each.
+
+    The same arguments always produce the same data, so benchmark runs on
+    different commits see the same database. Seeding again adds more rows.
+    """
+
+    rng = random.Random(random_seed)
+    password = hash_password(SEED_PASSWORD)     # hashed once, the key derivation would dominate otherwise
+
+    first_user = last_id(User)
+    insert(User.__table__, [{'username': 'user{}'.format(first_user + i),
+                             'email': 'user{}@example.com'.format(first_user + i),
+                             'password': password,
+                             'is_active': True,
+                             'created_at': SEED_EPOCH,
+                             'updated_at': SEED_EPOCH} for i in range(1, users + 1)], batch_size)
+    user_ids = new_ids(User, first_user)
+
+    first_review = last_id(Review)
+    for _, count in batches(reviews, batch_size):
+        rows = []
+        for _ in range(count):
+            created_at = SEED_EPOCH + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            rows.append({'title': sentence(rng, 4),
+                         'content': sentence(rng, 40),
+                         'rating': rng.randint(1, 10),
+                         'comments': 0,
+                         'is_publish': rng.random() < publish_ratio,
+                         'is_deleted': False,
+                         'user_id': rng.choice(user_ids),
+                         'created_at': created_at,
+                         'updated_at': created_at})
+        insert(Review.__table__, rows, batch_size)
+    review_ids = new_ids(Review, first_review)
+
+    for _, count in batches(comments if review_ids else 0, batch_size):
+        rows = []
+        for _ in range(count):
+            created_at = SEED_EPOCH + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+            rows.append({'content': sentence(rng, 12),
+                         'review_helpful': rng.random() < 0.5,
+                         'is_publish': rng.random() < publish_ratio,
+                         'user_id': rng.choice(user_ids),
+                         'review_id': rng.choice(review_ids),
+                         'created_at': created_at,
+                         'updated_at': created_at})
+        insert(Comment.__table__, rows, batch_size)
+
+    # core inserts skip the mapper events, fill the derived columns in one statement each
+    Comment.recount_review_comments()
+
+    if db.engine.name == 'postgresql':
+        Review.reindex()
+
+    # both updates above stamp updated_at with the current time, seeded rows keep their own
+    Review.query.filter(Review.id > first_review).update({Review.updated_at: Review.created_at},
+                                                         synchronize_session=False)
+    db.session.commit()
+
+    return len(user_ids), len(review_ids), comments if review_ids else 0
@@ -0,0 +1,35 @@
+import os
+import tempfile
+
+import pytest
+
+from config import Config
+
+# never run the tests against the database of config.py
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+# a resource running more queries than its QUERY_BUDGETS entry fails its test
+Config.QUERY_BUDGET_ENFORCE = True
+
+from app import create_app     # noqa: E402
+from extensions import db, cache     # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app()
+
+
+@pytest.fixture
+def database(app):
+    with app.app_context():
+        db.create_all()
+        yield db
+        db.session.remove()
+        db.drop_all()
+
+    cache.clear()
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
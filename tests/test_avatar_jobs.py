@@ -0,0 +1,49 @@
+"""Avatar uploads hold a slot of the image pool from submit until the job is done or rolled back."""
+from flask import Response
+
+from avatar_jobs import avatar_processor
+from models.avatar_job import AvatarJob
+from models.user import User
+from unit_of_work import unit_of_work
+
+
+def spooled(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'not an image yet')
+    return str(path)
+
+
+def test_slot_is_released_when_the_request_rolls_back(app, database, tmp_path):
+    user = User(username='author', email='author@example.com', password='x')
+    user.save()
+    source_path = spooled(tmp_path, 'upload.png')
+
+    with app.test_request_context():
+        unit_of_work.begin()
+        job_id = avatar_processor.submit(user_id=user.id, source_path=source_path, destination=str(tmp_path))
+
+        assert job_id is not None
+        assert avatar_processor.pending == 1
+
+        unit_of_work.finish(Response(status=500))
+
+    assert avatar_processor.pending == 0
+    assert not (tmp_path / 'upload.png').exists()
+    assert AvatarJob.get_by_id(job_id) is None
+
+
+def test_full_pool_turns_uploads_away(app, database, tmp_path, monkeypatch):
+    monkeypatch.setattr(avatar_processor, 'max_pending', 1)
+
+    with app.test_request_context():
+        unit_of_work.begin()
+
+        # the first upload is not committed yet, its slot is taken all the same
+        assert avatar_processor.submit(user_id=1, source_path=spooled(tmp_path, 'first.png'),
+                                       destination=str(tmp_path)) is not None
+        assert avatar_processor.submit(user_id=1, source_path=spooled(tmp_path, 'second.png'),
+                                       destination=str(tmp_path)) is None
+
+        unit_of_work.finish(Response(status=500))
+
+    assert avatar_processor.pending == 0
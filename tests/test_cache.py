@@ -0,0 +1,28 @@
+"""The in-process cache stays within its size, generations included."""
+from cache import LRUCache, ResponseCache
+
+
+def test_generations_are_bounded_by_maxsize():
+    backend = LRUCache(maxsize=8)
+
+    for number in range(100):
+        backend.bump('review:{}'.format(number))
+
+    assert len(backend.keys()) <= 8
+
+
+def test_evicted_generation_does_not_bring_back_old_entries():
+    cache = ResponseCache()
+    cache.backend = LRUCache(maxsize=3)
+
+    old_key = cache.key('review:1', 'page')
+    cache.backend.set(old_key, 'old page')
+    cache.invalidate('review:1')
+
+    # the old page is still cached, the generation of review:1 is pushed out
+    assert cache.backend.get(old_key) == 'old page'
+    cache.backend.set('a', 1)
+    cache.backend.set('b', 2)
+    assert 'gen:review:1' not in cache.backend.keys()
+
+    assert cache.key('review:1', 'page') != old_key
@@ -0,0 +1,88 @@
+"""CompiledSchema dumps exactly what the marshmallow schema it was built from dumps."""
+import json
+from functools import partial
+
+import pytest
+
+from extensions import db
+from models.comment import Comment
+from models.review import Review
+from models.rows import ReviewRow, CommentRow, to_rows
+from models.user import User
+from schemas.comment import CommentSchema
+from schemas.compiled import CompiledSchema
+from schemas.review import ReviewSchema
+from schemas.user import UserSchema
+
+SCHEMAS = {
+    'review': ('reviews', ReviewSchema),
+    'comment': ('comments', CommentSchema),
+    'user private': ('users', UserSchema),
+    'user public': ('users', partial(UserSchema, exclude=('email', ))),
+    'user suggestion': ('users', partial(UserSchema, only=('id', 'username', 'avatar_url'))),
+}
+
+
+@pytest.fixture
+def objects(database):
+    plain = User(username='plain', email='plain@example.com', password='x')
+    pictured = User(username='pictured', email='pictured@example.com', password='x', avatar_image='ab/cd/abcd')
+    db.session.add_all([plain, pictured])
+    db.session.flush()
+
+    reviews = [Review(title='Full', content='Content', rating=7, comments=2, is_publish=True, user_id=pictured.id),
+               Review(title='Sparse', user_id=plain.id),
+               Review(title='Orphan')]
+    db.session.add_all(reviews)
+    db.session.flush()
+
+    comments = [Comment(content='Helpful', review_helpful=True, is_publish=True, user_id=pictured.id,
+                        review_id=reviews[0].id),
+                Comment(content='Unhelpful', review_helpful=False, user_id=plain.id, review_id=reviews[0].id),
+                Comment(content='Orphan', review_id=reviews[1].id)]
+    db.session.add_all(comments)
+    db.session.commit()
+
+    return {'users': [plain, pictured], 'reviews': reviews, 'comments': comments}
+
+
+def assert_same_dump(schema_class, items, many):
+    expected = schema_class(many=many).dump(items).data
+    compiled = CompiledSchema(schema_class(many=many)).dump(items)
+
+    # same keys in the same order, same values
+    assert json.dumps(compiled) == json.dumps(expected)
+
+
+@pytest.mark.parametrize('name', SCHEMAS)
+def test_compiled_list_dump_matches_marshmallow(app, objects, name):
+    kind, schema_class = SCHEMAS[name]
+
+    with app.test_request_context():
+        assert_same_dump(schema_class, objects[kind], many=True)
+        assert_same_dump(schema_class, [], many=True)
+
+
+@pytest.mark.parametrize('name', SCHEMAS)
+def test_compiled_single_dump_matches_marshmallow(app, objects, name):
+    kind, schema_class = SCHEMAS[name]
+
+    with app.test_request_context():
+        for item in objects[kind]:
+            assert_same_dump(schema_class, item, many=False)
+
+
+@pytest.mark.parametrize('kind, model, row_class, schema_class', [('reviews', Review, ReviewRow, ReviewSchema),
+                                                                  ('comments', Comment, CommentRow, CommentSchema)])
+def test_compiled_row_dump_matches_marshmallow(app, objects, kind, model, row_class, schema_class):
+    rows = to_rows(row_class, model.rows_query().order_by(model.id))
+
+    with app.test_request_context():
+        assert_same_dump(schema_class, rows, many=True)
+
+        for row in rows:
+            assert_same_dump(schema_class, row, many=False)
+
+        # list pages dump rows, they must look the same as the full objects
+        assert json.dumps(CompiledSchema(schema_class(many=True)).dump(rows)) == \
+            json.dumps(schema_class(many=True).dump(objects[kind]).data)
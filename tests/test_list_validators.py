@@ -0,0 +1,62 @@
+"""List ETags change with the list, also when the write went through another worker."""
+import pytest
+from flask_jwt_extended import create_access_token
+
+from extensions import db
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+
+
+@pytest.fixture
+def rows(app, database):
+    user = User(username='author', email='author@example.com', password='x', is_active=True)
+    db.session.add(user)
+    db.session.flush()
+
+    review = Review(title='Review', content='Content', is_publish=True, user_id=user.id)
+    draft = Review(title='Draft', content='Content', user_id=user.id)
+    db.session.add_all([review, draft])
+    db.session.flush()
+
+    db.session.add(Comment(content='Comment', review_helpful=True, is_publish=True, user_id=user.id,
+                           review_id=review.id))
+    db.session.commit()
+
+    return {'review_id': review.id, 'draft_id': draft.id, 'user_id': user.id,
+            'token': create_access_token(identity=user.id)}
+
+
+def get(client, url, etag=None):
+    headers = {'If-None-Match': etag} if etag else {}
+    return client.get(url, headers=headers)
+
+
+def test_list_etag_changes_after_a_write(client, rows):
+    first = get(client, '/reviews')
+    assert get(client, '/reviews', first.headers['ETag']).status_code == 304
+
+    response = client.put('/reviews/{}/publish'.format(rows['draft_id']),
+                          headers={'Authorization': 'Bearer ' + rows['token']})
+    assert response.status_code == 204
+
+    second = get(client, '/reviews', first.headers['ETag'])
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert [review['title'] for review in second.get_json()['data']] == ['Draft', 'Review']
+
+
+@pytest.mark.parametrize('url', ['/reviews', '/reviews/{review_id}/comments'])
+def test_list_etag_changes_after_a_write_this_worker_was_not_told_about(client, rows, url):
+    url = url.format(**rows)
+    first = get(client, url)
+
+    # written by another worker: the rows change, the cache of this process is not invalidated
+    Comment.query.update({Comment.content: 'Edited'}, synchronize_session=False)
+    Review.query.update({Review.title: 'Edited'}, synchronize_session=False)
+    db.session.commit()
+
+    second = get(client, url, first.headers['ETag'])
+    assert second.status_code == 200
+    assert second.headers['ETag'] != first.headers['ETag']
+    assert second.get_json() != first.get_json()
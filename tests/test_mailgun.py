@@ -0,0 +1,101 @@
+"""The mail queue against benchmarks/fake_mailgun.py."""
+import logging
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+from flask import Flask
+
+from benchmarks import fake_mailgun
+from benchmarks.fake_mailgun import MailgunHandler
+from mailgun import MailQueue
+
+
+@pytest.fixture
+def mailgun(monkeypatch):
+    monkeypatch.setattr(fake_mailgun, 'stats', {'requests': 0, 'failed': 0, 'recipients': 0})
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MailgunHandler)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+
+    yield 'http://127.0.0.1:{}/v3/{{}}/messages'.format(server.server_port)
+
+    server.shutdown()
+    server.server_close()
+
+
+def mail_queue(api_url, **config):
+    app = Flask(__name__)
+    app.config.update(MAILGUN_DOMAIN='example.com', MAILGUN_API_KEY='key', MAILGUN_API_URL=api_url,
+                      MAIL_WORKERS=1, MAIL_RETRY_BACKOFF=0, **config)
+
+    queue = MailQueue()
+    queue.init_app(app)
+    return queue
+
+
+def test_emails_with_the_same_content_go_out_together(mailgun):
+    queue = mail_queue(mailgun)
+
+    # queued before the worker runs, so they are picked up as one batch
+    for number in range(10):
+        queue.queue.put((['user{}@example.com'.format(number)], 'Subject', 'Text', None))
+    queue.start()
+    queue.queue.join()
+
+    assert fake_mailgun.stats == {'requests': 1, 'failed': 0, 'recipients': 10}
+
+
+def test_failing_mailgun_is_retried_then_given_up(mailgun, monkeypatch):
+    monkeypatch.setattr(MailgunHandler, 'failure_rate', 1.0)
+    queue = mail_queue(mailgun, MAIL_MAX_RETRIES=2)
+
+    queue.send_email('user@example.com', 'Subject', 'Text')
+    queue.queue.join()
+
+    assert fake_mailgun.stats == {'requests': 3, 'failed': 3, 'recipients': 0}
+    assert all(worker.is_alive() for worker in queue.workers)
+
+
+def test_worker_survives_an_error_in_a_batch(mailgun, monkeypatch):
+    queue = mail_queue(mailgun)
+    deliver = queue.deliver
+
+    def broken_once(*args):
+        monkeypatch.setattr(queue, 'deliver', deliver)
+        raise ValueError('broken')
+
+    monkeypatch.setattr(queue, 'deliver', broken_once)
+
+    queue.send_email('first@example.com', 'First', 'Text')
+    queue.queue.join()
+    queue.send_email('second@example.com', 'Second', 'Text')
+    queue.queue.join()
+
+    assert fake_mailgun.stats == {'requests': 1, 'failed': 0, 'recipients': 1}
+
+
+def test_dead_workers_are_replaced(mailgun):
+    queue = mail_queue(mailgun)
+    queue.workers = [threading.Thread(target=lambda: None)]
+    queue.workers[0].start()
+    queue.workers[0].join()
+
+    queue.send_email('user@example.com', 'Subject', 'Text')
+    queue.queue.join()
+
+    assert fake_mailgun.stats['recipients'] == 1
+    assert all(worker.is_alive() for worker in queue.workers)
+
+
+def test_full_queue_drops_and_logs(mailgun, monkeypatch, caplog):
+    queue = mail_queue(mailgun, MAIL_QUEUE_SIZE=1)
+    monkeypatch.setattr(queue, 'start', lambda: None)     # nothing takes emails off the queue
+
+    queue.send_email('first@example.com', 'Subject', 'Text')
+
+    with caplog.at_level(logging.ERROR, logger='mailgun'):
+        queue.send_email('second@example.com', 'Subject', 'Text')
+
+    assert queue.queue.qsize() == 1
+    assert 'Mail queue is full' in caplog.text
@@ -0,0 +1,66 @@
+"""Every resource with a QUERY_BUDGETS entry stays within it, enforced by conftest.py."""
+import pytest
+from flask_jwt_extended import create_access_token
+
+from config import Config
+from extensions import db
+from instrumentation import QueryBudgetExceeded, request_timer
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+
+ROUTES = {
+    'ReviewListResource.get': ('get', '/reviews'),
+    'ReviewCommentListResource.get': ('get', '/reviews/{review_id}/comments'),
+    'UserReviewListResource.get': ('get', '/users/{username}/reviews?visibility=all'),
+    'UserCommentListResource.get': ('get', '/users/{username}/comments?visibility=all'),
+    'ReviewCommentPublishResource.put': ('put', '/reviews/{review_id}/comments/{comment_id}/publish'),
+    'ReviewCommentPublishResource.delete': ('delete', '/reviews/{review_id}/comments/{comment_id}/publish'),
+}
+
+
+@pytest.fixture
+def request_args(app, database):
+    user = User(username='author', email='author@example.com', password='x', is_active=True)
+    db.session.add(user)
+    db.session.flush()
+
+    review = Review(title='Review', content='Content', is_publish=True, user_id=user.id)
+    db.session.add(review)
+    db.session.flush()
+
+    comment = Comment(content='Comment', review_helpful=True, is_publish=True, user_id=user.id, review_id=review.id)
+    db.session.add(comment)
+    db.session.commit()
+
+    return {'review_id': review.id, 'comment_id': comment.id, 'username': user.username,
+            'token': create_access_token(identity=user.id)}
+
+
+def call(client, name, request_args):
+    method, url = ROUTES[name]
+
+    return getattr(client, method)(url.format(**request_args),
+                                   headers={'Authorization': 'Bearer ' + request_args['token']})
+
+
+def test_every_budget_is_requested():
+    assert set(ROUTES) == set(Config.QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize('name', sorted(ROUTES))
+def test_resource_stays_within_its_budget(client, request_args, name):
+    assert request_timer.enforce_budgets
+
+    response = call(client, name, request_args)
+
+    assert response.status_code < 400, response.get_data(as_text=True)
+
+
+def test_exceeded_budget_fails(app, client, request_args, monkeypatch):
+    monkeypatch.setitem(request_timer.budgets, 'ReviewListResource.get', 1)
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', True)
+    monkeypatch.setitem(app.config, 'PRESERVE_CONTEXT_ON_EXCEPTION', False)
+
+    with pytest.raises(QueryBudgetExceeded):
+        call(client, 'ReviewListResource.get', request_args)
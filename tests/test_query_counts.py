@@ -0,0 +1,78 @@
+"""List endpoints run the same number of queries whatever the number of rows they dump."""
+import pytest
+from sqlalchemy import event
+
+from extensions import db, cache
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+
+LIST_URLS = (
+    '/reviews',
+    '/reviews?sort=oldest',
+    '/reviews?sort=rating',
+    '/reviews/{review_id}/comments',
+    '/users/{username}/reviews',
+    '/users/{username}/comments',
+)
+
+
+def populate(rows):
+    """rows users each write a published review and a comment on the first review.
+
+    The first user writes rows reviews and comments, so every list has rows
+    entries or more, by rows different authors where it can.
+    """
+
+    db.drop_all()
+    db.create_all()
+    cache.clear()
+
+    users = [User(username='user{}'.format(i), email='user{}@example.com'.format(i), password='x', is_active=True)
+             for i in range(rows)]
+    db.session.add_all(users)
+    db.session.flush()
+
+    reviews = [Review(title='Review', content='Content', rating=i % 10 + 1, is_publish=True, user_id=user.id)
+               for i, user in enumerate(users + users[:1] * (rows - 1))]
+    db.session.add_all(reviews)
+    db.session.flush()
+
+    db.session.add_all(Comment(content='Comment', review_helpful=True, is_publish=True, user_id=user.id,
+                               review_id=reviews[0].id)
+                       for user in users + users[:1] * (rows - 1))
+    db.session.commit()
+
+    return reviews[0].id, users[0].username
+
+
+def count_queries(client, url):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    cache.clear()   # a cached page would skip its queries
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+    return len(statements), len(response.get_json()['data'])
+
+
+@pytest.mark.parametrize('url', LIST_URLS)
+def test_list_queries_do_not_grow_with_rows(client, url):
+    review_id, username = populate(1)
+    one, dumped = count_queries(client, url.format(review_id=review_id, username=username))
+    assert dumped == 1
+
+    review_id, username = populate(5)
+    many, dumped = count_queries(client, url.format(review_id=review_id, username=username))
+    assert dumped >= 5
+
+    assert many == one
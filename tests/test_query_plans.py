@@ -0,0 +1,19 @@
+"""Every query the models run while serving requests uses an index."""
+from models.review import Review
+from query_plans import check_query_plans, explain, sequential_scans
+from seed import seed
+
+
+def test_model_queries_use_an_index(database):
+    # sqlite plans by the indexes alone, a small seeded database is enough
+    seed(users=20, reviews=200, comments=1000)
+
+    failures = check_query_plans()
+
+    assert failures == [], '\n'.join('{}: {}'.format(name, '; '.join(plan)) for name, plan in failures)
+
+
+def test_unindexed_query_is_reported(database):
+    seed(users=2, reviews=10, comments=0)
+
+    assert sequential_scans(explain(Review.query.filter_by(title='Title')))
@@ -0,0 +1,80 @@
+"""GET requests read from a replica, unless it is down or the data was just written."""
+import shutil
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import create_engine
+
+from cache import LRUCache
+from extensions import db, cache
+from models.review import Review
+from models.user import User
+from routing import replica_router
+
+
+@pytest.fixture
+def reviews(database):
+    user = User(username='author', email='author@example.com', password='x', is_active=True)
+    db.session.add(user)
+    db.session.flush()
+
+    reviews = [Review(title='Published', content='Content', is_publish=True, user_id=user.id),
+               Review(title='Draft', content='Content', user_id=user.id)]
+    db.session.add_all(reviews)
+    db.session.commit()
+
+    # requests remove the session, keep what the tests need
+    return [(review.id, review.user_id) for review in reviews]
+
+
+def use_replica(monkeypatch, uri):
+    engine = create_engine(uri)
+
+    monkeypatch.setattr(replica_router, 'replicas', [engine])
+    monkeypatch.setattr(replica_router, 'down_until', {})
+    monkeypatch.setattr(replica_router, 'writes', LRUCache(ttl=5))
+    monkeypatch.setattr(cache, 'fresh_seconds', 5)
+
+    return engine
+
+
+def listed_titles(app, client):
+    # a request of its own app context, as outside the tests, so g starts empty
+    with app.app_context():
+        response = client.get('/reviews')
+    assert response.status_code == 200
+
+    return [review['title'] for review in response.get_json()['data']]
+
+
+def test_reads_fall_back_to_the_primary_when_the_replica_is_down(app, client, reviews, monkeypatch, tmp_path):
+    # sqlite can not create a database in a missing directory, connecting raises
+    replica = use_replica(monkeypatch, 'sqlite:///' + str(tmp_path / 'missing' / 'replica.db'))
+
+    assert listed_titles(app, client) == ['Published']
+    assert replica in replica_router.down_until
+
+
+def test_cache_is_filled_from_the_primary_after_a_write(app, client, reviews, monkeypatch, tmp_path):
+    # the replica has not seen the draft being published yet
+    replica_path = tmp_path / 'replica.db'
+    shutil.copy(db.engine.url.database, str(replica_path))
+    use_replica(monkeypatch, 'sqlite:///' + str(replica_path))
+
+    assert listed_titles(app, client) == ['Published']
+
+    draft_id, user_id = reviews[1]
+
+    with app.app_context():
+        token = create_access_token(identity=user_id)
+        response = client.put('/reviews/{}/publish'.format(draft_id), headers={'Authorization': 'Bearer ' + token})
+
+    assert response.status_code == 204
+
+    # another client, not sticky to the primary, must not cache the replica's old list
+    assert listed_titles(app, client) == ['Draft', 'Published']
+    assert listed_titles(app, client) == ['Draft', 'Published']
+
+    # past the window, reads go to the replica again
+    cache.clear()
+    assert listed_titles(app, client) == ['Published']
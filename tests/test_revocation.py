@@ -0,0 +1,64 @@
+"""The bloom filter of revoked tokens is rebuilt once per interval and keeps local revokes."""
+import threading
+import time
+
+from revocation import LocalStore, RevocationList
+
+
+class UncommittedStore(LocalStore):
+    """Revokes show up in active_jtis only once committed, as in the database."""
+
+    def __init__(self):
+        super().__init__()
+        self.uncommitted = {}
+        self.rebuilds = 0
+
+    def add(self, jti, expires_at):
+        self.uncommitted[jti] = expires_at
+
+    def commit(self):
+        for jti, expires_at in self.uncommitted.items():
+            super().add(jti, expires_at)
+        self.uncommitted.clear()
+
+    def active_jtis(self):
+        self.rebuilds += 1
+        time.sleep(0.01)    # long enough for the other threads to pile up on the lock
+        return super().active_jtis()
+
+
+def revocation_list():
+    revoked = RevocationList()
+    revoked.store = UncommittedStore()
+    return revoked
+
+
+def expiry():
+    return time.time() + 3600
+
+
+def test_revoke_survives_a_rebuild_before_its_commit():
+    revoked = revocation_list()
+    assert not revoked.is_revoked('other')
+
+    revoked.revoke('jti', expiry())
+
+    # the filter is rebuilt while the revoke is not committed yet
+    revoked.next_refresh = 0
+    assert not revoked.is_revoked('other')
+
+    revoked.store.commit()
+    assert revoked.is_revoked('jti')
+
+
+def test_concurrent_checks_rebuild_once():
+    revoked = revocation_list()
+    revoked.refresh_interval = 60
+
+    threads = [threading.Thread(target=revoked.is_revoked, args=('jti', )) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert revoked.store.rebuilds == 1
@@ -0,0 +1,57 @@
+"""Review search on sqlite, answered by the in-process inverted index."""
+import pytest
+
+from extensions import db
+from models.review import Review
+from models.user import User
+from search import review_index
+
+
+@pytest.fixture
+def reviews(database):
+    review_index.clear()    # the index outlives the database of the previous test
+
+    user = User(username='author', email='author@example.com', password='x', is_active=True)
+    db.session.add(user)
+    db.session.flush()
+
+    # five reviews tie on rank, two rank above them, two do not match
+    reviews = [Review(title='Morning', content='Good coffee', is_publish=True, user_id=user.id) for _ in range(5)]
+    reviews += [Review(title='Coffee', content='Good coffee', is_publish=True, user_id=user.id) for _ in range(2)]
+    reviews += [Review(title='Tea', content='Good tea', is_publish=True, user_id=user.id),
+                Review(title='Coffee', content='Unpublished coffee', user_id=user.id)]
+    db.session.add_all(reviews)
+    db.session.commit()
+
+    yield reviews
+
+    review_index.clear()
+
+
+def search_all(client, q, limit):
+    ids, cursor = [], None
+
+    while True:
+        params = {'q': q, 'limit': limit}
+        if cursor:
+            params['cursor'] = cursor
+
+        response = client.get('/reviews/search', query_string=params)
+        assert response.status_code == 200
+
+        body = response.get_json()
+        ids += [review['id'] for review in body['data']]
+        cursor = body['next_cursor']
+
+        if cursor is None:
+            return ids
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 5])
+def test_search_pages_through_ties_without_gaps_or_duplicates(client, reviews, limit):
+    ids = search_all(client, 'coffee', limit=limit)
+
+    ranked_higher = sorted((review.id for review in reviews[5:7]), reverse=True)
+    tied = sorted((review.id for review in reviews[:5]), reverse=True)
+
+    assert ids == ranked_higher + tied
@@ -0,0 +1,24 @@
+"""The same seed arguments produce the same database."""
+from extensions import db
+from models.comment import Comment
+from models.review import Review
+from models.user import User
+from seed import seed
+
+
+def dump(model):
+    columns = [column for column in model.__table__.columns if column.name != 'password']
+    return db.session.query(*columns).order_by(model.id).all()
+
+
+def test_seed_is_reproducible(database):
+    dumps = []
+
+    for _ in range(2):
+        db.drop_all()
+        db.create_all()
+        seed(users=5, reviews=20, comments=50, batch_size=7, random_seed=3)
+        dumps.append([dump(model) for model in (User, Review, Comment)])
+
+    assert dumps[0] == dumps[1]
+    assert len(dumps[0][2]) == 50
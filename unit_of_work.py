@@ -0,0 +1,92 @@
+from flask import g, has_request_context
+
+from extensions import db, cache
+
+
+class UnitOfWork:
+    """One transaction per request instead of one commit per save().
+
+    With UNIT_OF_WORK on, commit() inside a request only flushes, so ids and
+    constraint errors still show up right away, and the request's changes
+    are committed together once it succeeds. Responses with an error status
+    roll everything back. Outside requests (cli commands, background threads)
+    commit() commits right away as before.
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    def init_app(self, app):
+        self.enabled = app.config.get('UNIT_OF_WORK', True)
+
+        if self.enabled:
+            app.before_request(self.begin)
+            app.after_request(self.finish)
+            app.teardown_request(self.discard)
+
+    def active(self):
+        return self.enabled and has_request_context() and g.get('unit_of_work') is not None
+
+    def begin(self):
+        g.unit_of_work = []     # callbacks to run after the commit
+        g.unit_of_work_rollback = []    # and after a rollback
+
+    def commit(self):
+        if self.active():
+            db.session.flush()
+        else:
+            db.session.commit()
+
+    def after_commit(self, func):
+        """Runs func once the changes made so far are committed, right away outside a unit of work."""
+
+        if self.active():
+            g.unit_of_work.append(func)
+        else:
+            func()
+
+    def after_rollback(self, func):
+        """Runs func if the changes made so far are rolled back, never outside a unit of work."""
+
+        if self.active():
+            g.unit_of_work_rollback.append(func)
+
+    def rollback(self):
+        db.session.rollback()
+
+        for func in g.pop('unit_of_work_rollback', ()):
+            func()
+
+    def finish(self, response):
+        callbacks = g.pop('unit_of_work', None)
+
+        if callbacks is None:
+            return response
+
+        if response.status_code >= 400:
+            self.rollback()
+            return response
+
+        try:
+            db.session.commit()
+        except Exception:
+            self.rollback()
+            raise
+
+        g.pop('unit_of_work_rollback', None)
+
+        # entries cached from the old rows while the request was running are dropped too
+        cache.invalidate_committed()
+
+        for func in callbacks:
+            func()
+
+        return response
+
+    def discard(self, exception):
+        # after_request is skipped when the handler raised, nothing was committed then
+        if g.pop('unit_of_work', None) is not None:
+            self.rollback()
+
+
+unit_of_work = UnitOfWork()
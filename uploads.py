@@ -0,0 +1,83 @@
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+from PIL import Image
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+
+def sniff_image_format(head):
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+
+    return None
+
+
+class ImageSpool(SpooledTemporaryFile):
+    """Upload spool that checks the image while the body is still being read.
+
+    The format is sniffed from the first bytes and the dimensions from the
+    header, so an upload that is not an image, or that is too big, stops the
+    multipart parser before the rest of the body is read.
+    """
+
+    SNIFF_LIMIT = 256 * 1024   # give up reading dimensions after this much header
+
+    def __init__(self, max_bytes, max_pixels):
+        super().__init__(max_size=500 * 1024)
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.written = 0
+        self.head = b''
+        self.checked = False
+
+    def write(self, data):
+        self.written += len(data)
+
+        if self.written > self.max_bytes:
+            raise RequestEntityTooLarge('Image file is too large')
+
+        if not self.checked:
+            self.head += data
+            self.check_header()
+
+        return super().write(data)
+
+    def check_header(self):
+        if len(self.head) < 12:
+            return
+
+        if sniff_image_format(self.head) is None:
+            raise UnsupportedMediaType('Not a valid image')
+
+        try:
+            width, height = Image.open(BytesIO(self.head)).size
+        except Exception:
+            # header not complete yet
+            if len(self.head) < self.SNIFF_LIMIT:
+                return
+        else:
+            if width * height > self.max_pixels:
+                raise RequestEntityTooLarge('Image dimensions are too large')
+
+        self.checked = True
+        self.head = b''
+
+
+class UploadRequest(Request):
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return ImageSpool(max_bytes=current_app.config.get('AVATAR_MAX_SIZE', 10 * 1024 * 1024),
+                          max_pixels=current_app.config.get('AVATAR_MAX_PIXELS', 40 * 1000 * 1000))
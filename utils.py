@@ -1,5 +1,8 @@
+import hashlib
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
 from flask_uploads import extension
@@ -12,12 +15,35 @@ from flask import current_app
 from extensions import image_set
 
 
+password_pool = None
+password_pool_lock = threading.Lock()
+
+
+def run_password_job(func, *args):
+    # pbkdf2 releases the GIL, the pool size caps how many cores key derivation can take at once
+    global password_pool
+
+    with password_pool_lock:
+        if password_pool is None:
+            password_pool = ThreadPoolExecutor(max_workers=current_app.config.get('PASSWORD_HASH_WORKERS', 2))
+
+    return password_pool.submit(func, *args).result()
+
+
+def password_rounds():
+    return current_app.config.get('PASSWORD_HASH_ROUNDS', pbkdf2_sha256.default_rounds)
+
+
 def hash_password(password):
-    return pbkdf2_sha256.hash(password)
+    return run_password_job(pbkdf2_sha256.using(rounds=password_rounds()).hash, password)
 
 
 def check_password(password, hashed):
-    return pbkdf2_sha256.verify(password, hashed)
+    return run_password_job(pbkdf2_sha256.verify, password, hashed)
+
+
+def password_needs_rehash(hashed):
+    return pbkdf2_sha256.from_string(hashed).rounds != password_rounds()
 
 
 def generate_token(email, salt=None):
@@ -35,40 +61,102 @@ def verify_token(token, max_age=(30 * 60), salt=None):
     return email
 
 
-def save_image(image, folder):
+AVATAR_SIZES = (1024, 256, 64)
+AVATAR_FORMATS = (
+    ('jpg', 'JPEG', {'optimize': True, 'quality': 85}),
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+)
+
+
+def save_upload(image, directory):
+    # spooled outside the static folder, nothing serves the raw upload while it waits for the image pool
+    os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(os.path.abspath(directory), '{}.{}'.format(uuid.uuid4(), extension(image.filename)))
+    image.save(path)
+
+    return path
+
 
-    filename = '{}.{}'.format(uuid.uuid4(), extension(image.filename))
-    image_set.save(image, folder=folder, name=filename)
+def file_sha256(path):
+    digest = hashlib.sha256()
 
-    filename = compress_image(filename=filename, folder=folder)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
 
-    return filename
+    return digest.hexdigest()
 
 
-def compress_image(filename, folder):
+def avatar_name(content_hash):
+    # sharded as ab/cd/abcd..., so no directory ends up with millions of files
+    return '{}/{}/{}'.format(content_hash[:2], content_hash[2:4], content_hash)
 
-    file_path = image_set.path(filename=filename, folder=folder)
 
-    image = Image.open(file_path)
+def make_avatar_variants(source_path, destination):
+    # runs in the image process pool, so it must not touch the flask app
+
+    name = avatar_name(file_sha256(source_path))
+
+    variants = {}
+    for size in AVATAR_SIZES:
+        for ext, _, _ in AVATAR_FORMATS:
+            variants.setdefault(str(size), {})[ext] = '{}_{}.{}'.format(name, size, ext)
+
+    # identical upload was processed before, its variants are shared
+    if all(os.path.exists(os.path.join(destination, filename))
+           for formats in variants.values() for filename in formats.values()):
+        return variants
+
+    return render_avatar_variants(source_path, destination, name)
+
+
+def render_avatar_variants(source_path, destination, name):
+
+    image = Image.open(source_path)
+
+    # jpeg sources much larger than the biggest variant are decoded at 1/2, 1/4 or 1/8 scale
+    largest = max(AVATAR_SIZES)
+    image.draft('RGB', (largest, largest))
 
     if image.mode != "RGB":
         image = image.convert("RGB")
 
-    if max(image.width, image.height) > 1600:
-        maxsize = (1600, 1600)
-        image.thumbnail(maxsize)
+    os.makedirs(os.path.dirname(os.path.join(destination, name)), exist_ok=True)
+
+    variants = {}
+
+    # largest size first, every smaller size is thumbnailed from the previous one
+    for size in sorted(AVATAR_SIZES, reverse=True):
+        if max(image.width, image.height) > size:
+            image.thumbnail((size, size))
+
+        for ext, image_format, options in AVATAR_FORMATS:
+            filename = '{}_{}.{}'.format(name, size, ext)
+            path = os.path.join(destination, filename)
+
+            # written aside and renamed, so a concurrent identical upload never sees half a file
+            image.save(path + '.tmp', image_format, **options)
+            os.replace(path + '.tmp', path)
+
+            variants.setdefault(str(size), {})[ext] = filename
+
+    return variants
+
 
-    compressed_filename = '{}.jpg'.format(uuid.uuid4())
-    compressed_file_path = image_set.path(filename=compressed_filename, folder=folder)
+def avatar_variant_filenames(filename):
+    base = filename.rsplit('.', 1)[0]
 
-    image.save(compressed_file_path, optimize=True, quality=85)
+    if '_' not in base:     # avatars saved before variants existed
+        return [filename]
 
-    original_size = os.stat(file_path).st_size
-    compressed_size = os.stat(compressed_file_path).st_size
-    percentage = round((original_size - compressed_size) / original_size * 100)
+    name = base.rsplit('_', 1)[0]
+    return ['{}_{}.{}'.format(name, size, ext) for size in AVATAR_SIZES for ext, _, _ in AVATAR_FORMATS]
 
-    print("The file size is reduced by {}%, from {} to {}.".format(percentage, original_size, compressed_size))
 
-    os.remove(file_path)
+def remove_avatar(filename, folder):
 
-    return compressed_filename
+    for variant in avatar_variant_filenames(filename):
+        path = image_set.path(filename=variant, folder=folder)
+        if os.path.exists(path):
+            os.remove(path)